@@ -0,0 +1,65 @@
+"""
+Загрузка ветки комментариев по материализованному пути против обхода
+списка смежности запросом на каждый уровень.
+
+    python -m benchmarks.comment_threads --roots 200 --width 10 --depth 30
+"""
+import argparse
+
+from benchmarks.utils import best_of, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--roots", type=int, default=200,
+                        help="Корневых комментариев")
+    parser.add_argument("--width", type=int, default=10,
+                        help="Ответов на каждый корень")
+    parser.add_argument("--depth", type=int, default=30,
+                        help="Длина цепочки ответов под каждым корнем")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection, reset_queries
+    from posts.models import Comment, Post, User
+
+    author = User.objects.create_user(username="bench")
+    post = Post.objects.create(text="thread", author=author)
+    roots = []
+    for number in range(args.roots):
+        root = Comment.objects.create(post=post, author=author, text="root")
+        roots.append(root)
+        for _ in range(args.width):
+            Comment.objects.create(post=post, author=author, text="wide",
+                                   parent=root)
+        parent = root
+        for _ in range(args.depth):
+            parent = Comment.objects.create(post=post, author=author,
+                                            text="deep", parent=parent)
+    target = roots[len(roots) // 2]
+
+    def by_path():
+        return list(Comment.objects.filter(target.subtree_filter())
+                    .order_by("path"))
+
+    def by_levels():
+        found, level = [], [target.id]
+        while level:
+            children = list(Comment.objects.filter(parent_id__in=level))
+            found.extend(children)
+            level = [child.id for child in children]
+        return found
+
+    connection.force_debug_cursor = True
+    for name, func in (("materialised path", by_path),
+                       ("adjacency list", by_levels)):
+        reset_queries()
+        rows = len(func())
+        queries = len(connection.queries)
+        print(f"{name:18} {best_of(func):8.2f} ms, "
+              f"{queries} queries, {rows} rows")
+    print(f"comments: {Comment.objects.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Отдача файла: django.views.static.serve против posts.serving.serve.
+Тело ответа вычитывается целиком, как это сделал бы WSGI-сервер без
+file_wrapper; с gunicorn полный файл ушёл бы через os.sendfile, а при
+SENDFILE_BACKEND его отдал бы nginx.
+
+    python -m benchmarks.file_serving --size 50 --range 1
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from benchmarks.utils import best_of, setup_django
+
+
+def consume(response):
+    if response.streaming:
+        size = sum(map(len, response.streaming_content))
+    else:
+        size = len(response.content)
+    response.close()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50,
+                        help="Размер файла, МБ")
+    parser.add_argument("--range", type=int, default=1,
+                        help="Размер запрошенного диапазона, МБ")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import RequestFactory
+    from django.views import static
+    from posts import serving
+
+    root = tempfile.mkdtemp(prefix="yatube-serve-")
+    name = "video.mp4"
+    with open(os.path.join(root, name), "wb") as file:
+        file.write(os.urandom(args.size * 1024 * 1024))
+    factory = RequestFactory()
+    etag = serving.serve(factory.get("/"), name, document_root=root)["ETag"]
+    last_modified = static.serve(factory.get("/"), name,
+                                 document_root=root)["Last-Modified"]
+    headers = {
+        "full": {},
+        "range": {"HTTP_RANGE": f"bytes=0-{args.range * 1024 * 1024 - 1}"},
+    }
+
+    print(f"file: {args.size} MB, range: {args.range} MB")
+    for case, extra in headers.items():
+        def run(view):
+            return lambda: consume(view(factory.get("/", **extra), name,
+                                        document_root=root))
+        print(f"{case:12s} static.serve: {best_of(run(static.serve)):8.2f} ms"
+              f"   serving.serve: {best_of(run(serving.serve)):8.2f} ms")
+    revalidate_static = factory.get("/", HTTP_IF_MODIFIED_SINCE=last_modified)
+    revalidate = factory.get("/", HTTP_IF_NONE_MATCH=etag)
+    print(f"{'revalidate':12s} static.serve: "
+          f"{best_of(lambda: static.serve(revalidate_static, name, document_root=root)):8.2f} ms"
+          f"   serving.serve: "
+          f"{best_of(lambda: serving.serve(revalidate, name, document_root=root)):8.2f} ms")
+    shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Замер подбора рекомендаций на синтетическом графе подписок.
+
+    python -m benchmarks.follow_suggestions --users 100000 --edges 1000000
+
+Авторы выбираются со степенным распределением популярности, как в
+реальных социальных графах.
+"""
+import argparse
+import random
+import time
+import resource
+
+from posts.recommendations import suggest_authors
+
+
+def make_edges(users, edges, seed):
+    rnd = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(users)]
+    authors = rnd.choices(range(1, users + 1), weights=weights, k=edges)
+    return [(rnd.randint(1, users), author) for author in authors]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-fanout", type=int, default=50)
+    parser.add_argument("--max-similar", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    edges = make_edges(args.users, args.edges, args.seed)
+    started = time.perf_counter()
+    rows = sum(1 for _ in suggest_authors(edges, top=args.top,
+                                          max_fanout=args.max_fanout,
+                                          max_similar=args.max_similar))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"edges: {len(edges)}, users: {args.users}, suggestions: {rows}")
+    print(f"time: {elapsed:.1f}s, max RSS: {peak / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Отрисовка текста длинных записей в ленте: linebreaksbr с экранированием
+на каждом запросе против готового HTML из Post.text_html.
+
+    python -m benchmarks.post_render --length 20000 --page 10
+"""
+import argparse
+import random
+
+from benchmarks.utils import best_of, setup_django
+
+WORDS = ("lorem", "ipsum", "dolor", "<sit>", "amet", "&", "#django",
+         "@bench", "https://example.com/a?b=1", "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--length", type=int, default=20000,
+                        help="Длина текста записи в символах")
+    parser.add_argument("--page", type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.template import engines
+    from posts.models import Post, User
+
+    rnd = random.Random(1)
+    author = User.objects.create_user(username="bench")
+    for _ in range(args.page):
+        words = []
+        while sum(map(len, words)) < args.length:
+            words.append(rnd.choice(WORDS))
+        Post.objects.create(text=" ".join(words), author=author)
+    page = list(Post.objects.all())
+
+    engine = engines["django"]
+    on_request = engine.from_string(
+        "{% for post in page %}<p>{{ post.text|linebreaksbr }}</p>{% endfor %}")
+    stored = engine.from_string(
+        "{% for post in page %}<p>{{ post.text_html|safe }}</p>{% endfor %}")
+
+    print(f"page: {args.page} posts x {args.length} chars")
+    print(f"linebreaksbr:   {best_of(lambda: on_request.render({'page': page})):8.2f} ms")
+    print(f"text_html|safe: {best_of(lambda: stored.render({'page': page})):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
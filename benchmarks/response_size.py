@@ -0,0 +1,66 @@
+"""
+Размер страниц по view: исходные шаблоны, шаблоны без отступов и
+комментариев (posts.template_loaders) и они же после gzip
+(posts.middleware).
+
+    python -m benchmarks.response_size --posts 30 --comments 30
+"""
+import argparse
+import gzip
+
+from benchmarks.utils import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--comments", type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from posts.models import Comment, Group, Post, User
+
+    author = User.objects.create_user(username="bench")
+    group = Group.objects.create(title="bench", slug="bench", description="")
+    posts = [Post.objects.create(text=f"post #{number} @bench", author=author,
+                                 group=group)
+             for number in range(args.posts)]
+    for number in range(args.comments):
+        Comment.objects.create(post=posts[-1], author=author,
+                               text=f"comment {number}")
+    client = Client()
+    client.force_login(author)
+    urls = {
+        "index": reverse("index"),
+        "group_posts": reverse("group_post", args=[group.slug]),
+        "profile": reverse("profile", args=[author.username]),
+        "post": reverse("post", args=[author.username, posts[-1].id]),
+    }
+    plain = [dict(settings.TEMPLATES[0], APP_DIRS=True,
+                  OPTIONS={key: value for key, value
+                           in settings.TEMPLATES[0]["OPTIONS"].items()
+                           if key != "loaders"})]
+
+    def render(url):
+        # без Accept-Encoding middleware не сжимает ответ; кеш фрагментов
+        # сбрасывается, чтобы каждый раз рендерились шаблоны
+        cache.clear()
+        with override_settings(DEBUG=False):
+            return client.get(url).content
+
+    print(f"{'view':12s} {'source':>8s} {'minified':>9s} {'gzip':>7s} {'saved':>7s}")
+    for view, url in urls.items():
+        with override_settings(TEMPLATES=plain):
+            source = len(render(url))
+        minified = render(url)
+        compressed = len(gzip.compress(minified))
+        print(f"{view:12s} {source:8d} {len(minified):9d} {compressed:7d} "
+              f"{100 * (1 - compressed / source):6.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Пропускная способность записи при разном числе шардов: ``--writers``
+потоков одновременно публикуют записи от своих авторов, каждая запись —
+отдельная транзакция в файле sqlite.
+
+    python -m benchmarks.sharding --shards 1 2 4 8 --writers 8 --posts 300
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+
+def configure(directory, aliases):
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+
+    for alias in aliases:
+        connections.databases[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, f'{alias}.sqlite3'),
+            'OPTIONS': {'timeout': 60},
+        }
+        call_command('migrate', database=alias, verbosity=0)
+    settings.POST_SHARDS = aliases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--posts", type=int, default=300,
+                        help="Записей на один поток")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="yatube-shards-")
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    from django.conf import settings
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(directory, 'default.sqlite3'),
+        'OPTIONS': {'timeout': 60},
+    }
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connections
+    call_command('migrate', verbosity=0)
+    from posts.models import Post, User
+
+    print(f"writers: {args.writers}, posts per writer: {args.posts}")
+    for count in args.shards:
+        configure(directory, [f'shards{count}_{number}' for number in range(count)])
+        authors = [User.objects.create_user(username=f"s{count}w{number}")
+                   for number in range(args.writers)]
+
+        def write(author):
+            for number in range(args.posts):
+                Post.objects.create(text=f"post {number}", author=author)
+            connections.close_all()
+
+        threads = [threading.Thread(target=write, args=(author,))
+                   for author in authors]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        total = args.writers * args.posts
+        rows = [Post.objects.using(alias).count()
+                for alias in ['default'] + settings.POST_SHARDS]
+        print(f"shards: {count:2d}  {total / elapsed:8.0f} posts/s  "
+              f"rows (default, shards): {rows[0]}, {rows[1:]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Сравнение ленты обсуждаемых записей из таблицы PostScore с подсчётом
+комментариев в момент запроса.
+
+    python -m benchmarks.trending --posts 50000 --comments 500000
+"""
+import argparse
+import random
+
+from benchmarks.utils import best_of, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=50000)
+    parser.add_argument("--comments", type=int, default=500000)
+    parser.add_argument("--page", type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Count
+    from posts.models import Comment, Post, PostScore, User
+
+    rnd = random.Random(1)
+    author = User.objects.create_user(username="bench")
+    Post.objects.bulk_create(
+        (Post(text=f"post {i}", author=author) for i in range(args.posts)),
+        batch_size=500)
+    post_ids = list(Post.objects.values_list("id", flat=True))
+    hot = post_ids[-args.posts // 10:]
+    Comment.objects.bulk_create(
+        (Comment(post_id=rnd.choice(hot), author=author, text="c")
+         for _ in range(args.comments)), batch_size=500)
+    counts = (Comment.objects.order_by().values("post_id")
+              .annotate(n=Count("id")))
+    PostScore.objects.bulk_create(
+        (PostScore(post_id=row["post_id"], score=row["n"]) for row in counts),
+        batch_size=500)
+
+    def from_table():
+        list(Post.objects.filter(score__score__gt=0)
+             .order_by("-score__score")[:args.page])
+
+    def on_the_fly():
+        list(Post.objects.annotate(n=Count("comments"))
+             .order_by("-n")[:args.page])
+
+    print(f"posts: {args.posts}, comments: {args.comments}")
+    print(f"PostScore table:     {best_of(from_table):8.2f} ms")
+    print(f"annotate + order_by: {best_of(on_the_fly):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
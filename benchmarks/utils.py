@@ -0,0 +1,21 @@
+import os
+import time
+
+
+def setup_django():
+    """Поднимает Django с отдельной тестовой базой sqlite в памяти."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    import django
+    django.setup()
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0)
+
+
+def best_of(func, repeat=5):
+    """Лучшее время из ``repeat`` запусков, в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
@@ -0,0 +1,59 @@
+"""
+Сокращение записи буфером счётчиков просмотров: UPDATE на каждый
+просмотр против сброса пачками через UPDATE ... CASE.
+
+    python -m benchmarks.view_counters --posts 1000 --views 100000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.utils import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--views", type=int, default=100000)
+    parser.add_argument("--flush-size", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import F
+    from posts.counters import CounterBuffer
+    from posts.models import Post, User
+
+    author = User.objects.create_user(username="bench")
+    Post.objects.bulk_create(
+        (Post(text=f"post {i}", author=author) for i in range(args.posts)),
+        batch_size=500)
+    ids = list(Post.objects.values_list("id", flat=True))
+    rnd = random.Random(1)
+    weights = [1.0 / (rank + 1) for rank in range(len(ids))]
+    views = rnd.choices(ids, weights=weights, k=args.views)
+
+    started = time.perf_counter()
+    for post_id in views:
+        Post.objects.filter(pk=post_id).update(view_count=F("view_count") + 1)
+    direct = time.perf_counter() - started
+
+    buffer = CounterBuffer(Post, "view_count", flush_interval=float("inf"),
+                           max_pending=args.flush_size)
+    started = time.perf_counter()
+    for post_id in views:
+        buffer.add(post_id)
+    buffer.flush()
+    buffered = time.perf_counter() - started
+
+    total = sum(Post.objects.values_list("view_count", flat=True))
+    assert total == 2 * args.views, total
+    print(f"views: {args.views}, posts: {args.posts}")
+    print(f"UPDATE per view: {args.views} statements, {direct:.2f}s")
+    print(f"buffered:        {buffer.stats['statements']} statements "
+          f"in {buffer.stats['flushes']} flushes, {buffered:.2f}s")
+    print(f"write amplification: {buffer.write_amplification():.4f} "
+          f"statements per view")
+
+
+if __name__ == "__main__":
+    main()
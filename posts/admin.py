@@ -1,19 +1,107 @@
+"""
+Админка для больших таблиц.
+
+* связанные объекты списка загружаются тем же запросом
+  (list_select_related), а не отдельным запросом на строку;
+* число строк списка кешируется на ADMIN_COUNT_TIMEOUT секунд
+  (CachedCountPaginator), а общее число без фильтров не считается;
+* внешние ключи в формах — поле для id или автодополнение вместо
+  <select> со всеми пользователями и сообществами;
+* удаление идёт порциями по ADMIN_ACTION_CHUNK_SIZE строк в коротких
+  транзакциях без страницы подтверждения со списком всех объектов.
+"""
+import hashlib
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from posts.deletion import delete_in_chunks, schedule_group_deletion
+from posts.models import Comment, Follow, Group, Post
+
+ADMIN_COUNT_KEY = 'admin:count:{}'
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который берёт COUNT(*) запроса из кеша."""
+
+    @cached_property
+    def count(self):
+        try:
+            sql = str(self.object_list.query)
+        except EmptyResultSet:
+            return 0
+        key = ADMIN_COUNT_KEY.format(hashlib.md5(sql.encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, settings.ADMIN_COUNT_TIMEOUT)
+        return count
+
 
-from posts.models import Post, Group
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+    actions = ("delete_selected_in_chunks",)
 
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # стандартное удаление загружает все объекты и их каскад разом
+        actions.pop("delete_selected", None)
+        return actions
 
-class PostAdmin(admin.ModelAdmin):
-    list_display = ("pk", "text", "pub_date", "author")
+    def delete_selected_in_chunks(self, request, queryset):
+        deleted = sum(delete_in_chunks(queryset.order_by("pk"),
+                                       settings.ADMIN_ACTION_CHUNK_SIZE))
+        self.message_user(request, f"Удалено: {deleted}")
+    delete_selected_in_chunks.short_description = "Удалить порциями"
+    delete_selected_in_chunks.allowed_permissions = ("delete",)
+
+
+class PostAdmin(LargeTableAdmin):
+    list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
+    date_hierarchy = "pub_date"
+    raw_id_fields = ("author",)
+    autocomplete_fields = ("group",)
     empty_value_display = "-пусто-"
 
 
+class CommentAdmin(LargeTableAdmin):
+    list_display = ("pk", "text", "created", "author", "post_id")
+    list_select_related = ("author",)
+    search_fields = ("=author__username",)
+    date_hierarchy = "created"
+    raw_id_fields = ("post", "author", "parent")
+
+
+class FollowAdmin(LargeTableAdmin):
+    list_display = ("pk", "user", "author")
+    list_select_related = ("user", "author")
+    search_fields = ("=user__username", "=author__username")
+    raw_id_fields = ("user", "author")
+
+
 class GroupAdmin(admin.ModelAdmin):
-    list_display = ("pk", "title", "slug", "description")
+    list_display = ("pk", "title", "slug", "description", "is_deleted")
     search_fields = ("slug",)
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+    actions = ("delete_in_background",)
+
+    def delete_in_background(self, request, queryset):
+        for group in queryset.filter(is_deleted=False).iterator():
+            schedule_group_deletion(group)
+        self.message_user(request, "Сообщества скрыты и будут удалены в фоне")
+    delete_in_background.short_description = "Удалить в фоне"
 
 
 admin.site.register(Post, PostAdmin)
-admin.site.register(Group, GroupAdmin)
\ No newline at end of file
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(Follow, FollowAdmin)
+admin.site.register(Group, GroupAdmin)
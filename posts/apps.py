@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        # подключаем обработчики сигналов для сброса кешей
+        from . import signals  # noqa
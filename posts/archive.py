@@ -0,0 +1,115 @@
+"""
+Горячие и холодные записи.
+
+Лента почти всегда читает первые страницы, а старые записи лишь
+раздувают таблицу posts_post и её индексы. Команда archive_posts
+переносит записи старше ARCHIVE_AFTER_DAYS дней вместе с комментариями
+в таблицы ArchivedPost и ArchivedComment, сохраняя id. Лента сначала
+листает горячую таблицу и обращается к архиву только на страницах за её
+концом, а постоянная ссылка на запись ищет её в архиве, если в горячей
+таблице записи уже нет.
+
+Архив только для чтения: реакции и рейтинг обсуждаемости при переносе
+отбрасываются (счётчик реакций сохраняется), комментировать старые
+записи нельзя. Строки PostTag и PostMention тоже удаляются вместе с
+записью, поэтому ленты тега и упоминаний показывают только горячие
+записи. Копии изображения для srcset удаляются, и карточка архивной
+записи показывает миниатюру sorl.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedComment, ArchivedPost, Comment, Post, media_names
+from .sharding import post_databases, sharded
+from .storage import change_references
+
+POST_FIELDS = ('id', 'text', 'text_html', 'pub_date', 'author_id',
+               'group_id', 'image', 'image_width', 'image_height',
+               'image_format', 'reaction_count', 'view_count')
+COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'text', 'created',
+                  'parent_id', 'path', 'depth')
+
+
+class HotColdFeed:
+    """
+    Последовательность для Paginator: записи ``hot``, за ними ``cold``.
+    Оба queryset должны быть упорядочены одинаково; архив запрашивается,
+    только когда срез выходит за число горячих записей.
+    """
+
+    def __init__(self, hot, cold):
+        self.hot = hot
+        self.cold = cold
+        self._hot_count = None
+
+    def hot_count(self):
+        if self._hot_count is None:
+            self._hot_count = self.hot.count()
+        return self._hot_count
+
+    def count(self):
+        return self.hot_count() + self.cold.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("HotColdFeed поддерживает только срезы")
+        start, stop = key.start or 0, key.stop
+        items = []
+        if self._hot_count is None or start < self._hot_count:
+            items += self.hot[start:stop]
+            if len(items) == stop - start:
+                # срез целиком из горячих записей, считать их незачем
+                return items
+            if items:
+                # горячие записи кончились внутри среза
+                self._hot_count = start + len(items)
+        hot_count = self.hot_count()
+        if stop > hot_count:
+            items += self.cold[max(start - hot_count, 0):stop - hot_count]
+        return items
+
+
+def with_archive(hot, **filters):
+    """Лента ``hot`` с продолжением из архива по тем же условиям."""
+    cold = ArchivedPost.objects.visible().filter(**filters).select_related(
+        'author', 'group')
+    return HotColdFeed(hot, sharded(cold))
+
+
+def _archive_chunk(pks, using):
+    with transaction.atomic(using=using):
+        posts = Post.objects.using(using).filter(pk__in=pks).values(*POST_FIELDS)
+        archived = ArchivedPost.objects.using(using).bulk_create(
+            [ArchivedPost(**row) for row in posts], ignore_conflicts=True)
+        # удаление записи ниже отпустит её изображение, архив берёт его себе
+        names = media_names(archived)
+        transaction.on_commit(lambda: change_references(names, 1),
+                              using=using)
+        comments = Comment.objects.using(using).filter(
+            post_id__in=pks).order_by().values(*COMMENT_FIELDS)
+        ArchivedComment.objects.using(using).bulk_create(
+            [ArchivedComment(**row) for row in comments.iterator()],
+            batch_size=500, ignore_conflicts=True)
+        # каскадом уходят комментарии, реакции, рейтинг, теги, упоминания
+        # и копии изображения
+        Post.objects.using(using).filter(pk__in=pks).delete()
+
+
+def archive_posts(days, chunk_size=500):
+    """
+    Переносит в архив записи старше ``days`` дней порциями по
+    ``chunk_size`` записей, каждая в своей короткой транзакции. Отдаёт
+    число перенесённых записей после каждой порции.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    for using in post_databases():
+        old = Post.objects.using(using).filter(
+            pub_date__lt=cutoff).order_by('pub_date')
+        while True:
+            pks = list(old.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                break
+            _archive_chunk(pks, using)
+            yield len(pks)
@@ -0,0 +1,56 @@
+"""
+Пользователь запроса из кеша.
+
+AuthenticationMiddleware на каждом запросе читает User по id из сессии.
+CachedModelBackend берёт его из кеша, а вместе с сессиями cached_db
+запрос авторизованного пользователя не обращается к базе ни за
+сессией, ни за пользователем.
+
+Ключ кеша содержит версию пользователя. Любое сохранение или удаление
+User (смена пароля, правка профиля, блокировка) записывает новую
+случайную версию сразу и ещё раз после коммита, и старая запись больше
+не читается, даже если параллельный запрос успел положить её в кеш.
+Версия случайная, а не счётчик, чтобы после вытеснения версии из кеша
+не ожила старая копия пользователя. Смена пароля по-прежнему
+разлогинивает другие сессии: хеш сессии сверяется с паролем из свежей
+копии пользователя.
+
+Версии и пользователи хранятся в общем кеше (CACHES в settings), иначе
+другие процессы сервера не узнали бы о смене пароля или блокировке.
+"""
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+VERSION_KEY = 'auth_user_version:{}'
+USER_KEY = 'auth_user:{}:{}'
+
+
+def user_cache_key(user_id):
+    version = cache.get(VERSION_KEY.format(user_id))
+    if version is None:
+        # версии ещё нет или её вытеснили из кеша
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY.format(user_id), version, None):
+            version = cache.get(VERSION_KEY.format(user_id), version)
+    return USER_KEY.format(user_id, version)
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+    cache.set(VERSION_KEY.format(user_id), uuid.uuid4().hex, None)
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from .models import DeletionJob, Follow, Group
+from .sharding import post_databases
+
+GROUP_STATS_KEY = 'groups:stats'
+GROUP_STATS_TIMEOUT = 60 * 15
+
+FOLLOW_KEY = 'follow:authors:{}'
+FOLLOW_TIMEOUT = 60 * 60 * 24
+
+FEED_COUNT_KEY = 'feed:count:{}'
+FEED_COUNT_LOCK_KEY = 'feed:count:{}:lock'
+FEED_COUNT_LOCK_TIMEOUT = 60
+
+PENDING_DELETIONS_KEY = 'deletion:pending_users'
+PENDING_DELETIONS_TIMEOUT = 60 * 60 * 24
+
+
+def group_stats():
+    """
+    Список сообществ с числом записей, датой последней записи и числом
+    активных авторов. Считается одним сгруппированным запросом и хранится
+    в кеше до изменения записей или сообществ.
+    """
+    stats = cache.get(GROUP_STATS_KEY)
+    if stats is None:
+        for using in post_databases():
+            rows = _count_group_posts(using)
+            if stats is None:
+                stats = rows
+                continue
+            # автор целиком живёт в одном шарде, поэтому авторов можно складывать
+            for row, other in zip(stats, rows):
+                row['post_count'] += other['post_count']
+                row['author_count'] += other['author_count']
+                row['last_post'] = max(
+                    filter(None, (row['last_post'], other['last_post'])),
+                    default=None)
+        cache.set(GROUP_STATS_KEY, stats, GROUP_STATS_TIMEOUT)
+    return stats
+
+
+def _count_group_posts(using):
+    # записи скрытых авторов не считаются, как и в лентах
+    shown = Q(posts_group__author__is_active=True)
+    pending = pending_user_deletions()
+    if pending:
+        shown &= ~Q(posts_group__author_id__in=pending)
+    return list(
+        Group.objects.using(using).filter(is_deleted=False).annotate(
+            post_count=Count('posts_group', filter=shown),
+            last_post=Max('posts_group__pub_date', filter=shown),
+            author_count=Count('posts_group__author', distinct=True,
+                               filter=shown),
+        ).values(
+            'id', 'title', 'slug', 'description',
+            'post_count', 'last_post', 'author_count',
+        ).order_by('title', 'id')
+    )
+
+
+def invalidate_group_stats():
+    cache.delete(GROUP_STATS_KEY)
+
+
+def pending_user_deletions():
+    """
+    id пользователей с незавершённой задачей удаления. Их немного, поэтому
+    список целиком хранится в кеше и подставляется в запросы к любому шарду,
+    а не присоединяется к таблице задач из основной базы.
+    """
+    pending = cache.get(PENDING_DELETIONS_KEY)
+    if pending is None:
+        pending = list(DeletionJob.objects.filter(
+            kind=DeletionJob.USER, finished__isnull=True,
+        ).values_list('object_id', flat=True))
+        cache.set(PENDING_DELETIONS_KEY, pending, PENDING_DELETIONS_TIMEOUT)
+    return pending
+
+
+def invalidate_pending_deletions():
+    cache.delete(PENDING_DELETIONS_KEY)
+
+
+def followed_authors(user_id):
+    """
+    Отсортированный массив id авторов, на которых подписан пользователь.
+    В кеше хранится компактно — байтами массива ``array('l')`` — и
+    загружается из posts_follow только при первом обращении.
+    """
+    data = cache.get(FOLLOW_KEY.format(user_id))
+    authors = array('l')
+    if data is None:
+        authors.extend(
+            Follow.objects.filter(user_id=user_id)
+            .order_by('author_id')
+            .values_list('author_id', flat=True)
+        )
+        cache.set(FOLLOW_KEY.format(user_id), authors.tobytes(),
+                  FOLLOW_TIMEOUT)
+    else:
+        authors.frombytes(data)
+    return authors
+
+
+def is_following(user_id, author_id):
+    authors = followed_authors(user_id)
+    index = bisect_left(authors, author_id)
+    return index < len(authors) and authors[index] == author_id
+
+
+def _update_followed_authors(user_id, author_id, add):
+    # незагруженный набор не трогаем: он соберётся из базы при обращении
+    data = cache.get(FOLLOW_KEY.format(user_id))
+    if data is None:
+        return
+    authors = array('l')
+    authors.frombytes(data)
+    index = bisect_left(authors, author_id)
+    present = index < len(authors) and authors[index] == author_id
+    if add and not present:
+        authors.insert(index, author_id)
+    elif not add and present:
+        del authors[index]
+    else:
+        return
+    cache.set(FOLLOW_KEY.format(user_id), authors.tobytes(), FOLLOW_TIMEOUT)
+
+
+def add_followed_author(user_id, author_id):
+    _update_followed_authors(user_id, author_id, add=True)
+
+
+def remove_followed_author(user_id, author_id):
+    _update_followed_authors(user_id, author_id, add=False)
+
+
+def reset_followed_authors(user_id):
+    cache.delete(FOLLOW_KEY.format(user_id))
+
+
+def feed_count(scope, count):
+    """
+    Число записей ленты ``scope`` ('all', 'group:<id>', 'author:<id>',
+    'follow:<id>') из кеша. При промахе его считает ``count()``, но лишь
+    один запрос на ленту одновременно: остальные получают None и листают
+    ленту без общего числа страниц.
+    """
+    key = FEED_COUNT_KEY.format(scope)
+    total = cache.get(key)
+    if total is not None:
+        return total
+    lock = FEED_COUNT_LOCK_KEY.format(scope)
+    if not cache.add(lock, 1, FEED_COUNT_LOCK_TIMEOUT):
+        return None
+    try:
+        total = count()
+        cache.set(key, total, settings.FEED_COUNT_TIMEOUT)
+    finally:
+        cache.delete(lock)
+    return total
+
+
+def increment_feed_counts(*scopes):
+    # ещё не посчитанные ленты не трогаем, их посчитает первый запрос
+    for scope in scopes:
+        try:
+            cache.incr(FEED_COUNT_KEY.format(scope))
+        except ValueError:
+            pass
+
+
+def invalidate_feed_counts(*scopes):
+    cache.delete_many([FEED_COUNT_KEY.format(scope) for scope in scopes])
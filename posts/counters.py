@@ -0,0 +1,189 @@
+"""
+Счётчики, которые копятся в памяти процесса и записываются в базу
+пачками. Горячая запись не обновляет свою строку на каждый клик или
+просмотр и не занимает единственного писателя sqlite: приращения
+складываются в буфер и сбрасываются раз в ``flush_interval`` секунд,
+при накоплении ``max_pending`` строк и при завершении воркера. Воркер,
+к которому не приходят запросы, сбрасывает буферы фоновым потоком
+``start_flush_timer``, а ``flush_all`` регистрируется через atexit; то и
+другое подключается в yatube/wsgi.py.
+
+Сброс — один ``UPDATE ... SET f = MAX(f + CASE pk WHEN ... END, 0)`` на
+пачку строк, поэтому тысячи приращений превращаются в единицы запросов.
+Отрицательная сумма (лайк в одном воркере, отмена в другом) не опускает
+счётчик ниже нуля. Если запись не удалась, приращения возвращаются в
+буфер и уйдут со следующим сбросом. Статистика в ``stats`` показывает,
+во сколько раз сократилась запись.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Post, PostScore, ProfileStats
+from .sharding import databases_for
+
+# на строку в CASE уходит два параметра и ещё один в IN, а sqlite
+# принимает не больше 999 параметров в запросе
+FLUSH_CHUNK_SIZE = 300
+
+logger = logging.getLogger(__name__)
+BUFFERS = []
+
+
+class CounterBuffer:
+    def __init__(self, model, field, flush_interval=None, max_pending=None,
+                 create_missing=False):
+        self.model = model
+        self.field = field
+        self.flush_interval = (settings.COUNTER_FLUSH_INTERVAL
+                               if flush_interval is None else flush_interval)
+        self.max_pending = (settings.COUNTER_FLUSH_SIZE
+                            if max_pending is None else max_pending)
+        # создавать ли недостающие строки перед сбросом
+        self.create_missing = create_missing
+        self.stats = Counter()
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        BUFFERS.append(self)
+
+    def add(self, pk, delta=1):
+        with self._lock:
+            self._pending[pk] += delta
+            self.stats['increments'] += 1
+            due = (len(self._pending) >= self.max_pending or
+                   time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                # приращения вернулись в буфер, запрос из-за них не падает
+                logger.exception("Не удалось сбросить счётчик %s.%s",
+                                 self.model.__name__, self.field)
+
+    def pending(self, pk):
+        """Приращение, ещё не записанное в базу."""
+        return self._pending.get(pk, 0)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        pending = [(pk, delta) for pk, delta in pending.items() if delta]
+        if not pending:
+            return 0
+        databases = databases_for(self.model)
+        written = set()
+        try:
+            # в каждом шарде обновятся только строки, которые в нём есть
+            for using in databases:
+                with transaction.atomic(using=using):
+                    found = self._write(pending, using, len(databases) > 1)
+                written.update(found)
+        except Exception:
+            self._restore(pending, written)
+            raise
+        self.stats['flushes'] += 1
+        self.stats['rows'] += len(pending)
+        return len(pending)
+
+    def _write(self, pending, using, find_rows):
+        """Записывает приращения в базу ``using``. При нескольких базах
+        возвращает ключи строк, которые в ней нашлись."""
+        field = self.model._meta.get_field(self.field)
+        queryset = self.model.objects.using(using)
+        found = []
+        for start in range(0, len(pending), FLUSH_CHUNK_SIZE):
+            chunk = pending[start:start + FLUSH_CHUNK_SIZE]
+            keys = [pk for pk, _ in chunk]
+            if self.create_missing:
+                self._create_missing(keys, using)
+            if find_rows:
+                found += queryset.filter(pk__in=keys).values_list(
+                    'pk', flat=True)
+                self.stats['statements'] += 1
+            queryset.filter(pk__in=keys).update(**{
+                self.field: Greatest(
+                    F(self.field) + Case(
+                        *[When(pk=pk, then=Value(delta))
+                          for pk, delta in chunk],
+                        default=Value(0),
+                        output_field=field,
+                    ),
+                    Value(0),
+                    output_field=field,
+                )
+            })
+            self.stats['statements'] += 1
+        return found
+
+    def _restore(self, pending, written):
+        # строки из баз, где запись прошла, второй раз не прибавляются
+        with self._lock:
+            for pk, delta in pending:
+                if pk not in written:
+                    self._pending[pk] += delta
+        self.stats['failures'] += 1
+
+    def _create_missing(self, keys, using):
+        # ключ — ссылка на запись или автора, которые могли успеть удалить
+        target = self.model._meta.pk.related_model
+        existing = target._default_manager.using(using).filter(
+            pk__in=keys).values_list('pk', flat=True)
+        self.model.objects.using(using).bulk_create(
+            [self.model(pk=pk) for pk in existing], ignore_conflicts=True)
+        self.stats['statements'] += 2
+
+    def clear(self):
+        """Отбрасывает накопленное без записи в базу."""
+        with self._lock:
+            self._pending.clear()
+            self._flushed_at = time.monotonic()
+
+    def write_amplification(self):
+        """Доля запросов к базе на одно приращение: 1.0 без буфера."""
+        if not self.stats['increments']:
+            return 0.0
+        return self.stats['statements'] / self.stats['increments']
+
+
+reaction_counts = CounterBuffer(Post, 'reaction_count')
+post_views = CounterBuffer(Post, 'view_count')
+profile_views = CounterBuffer(ProfileStats, 'views', create_missing=True)
+view_scores = CounterBuffer(PostScore, 'score', create_missing=True)
+
+
+def flush_all():
+    """Сбрасывает все буферы, ошибка одного не мешает остальным."""
+    for buffer in BUFFERS:
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception("Не удалось сбросить счётчик %s.%s",
+                             buffer.model.__name__, buffer.field)
+
+
+def start_flush_timer(interval=None):
+    """
+    Запускает фоновый поток, который раз в ``interval`` секунд
+    (COUNTER_FLUSH_INTERVAL) сбрасывает все буферы процесса. Возвращает
+    threading.Event: его установка останавливает поток.
+    """
+    if interval is None:
+        interval = settings.COUNTER_FLUSH_INTERVAL
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            flush_all()
+            # у потока своё соединение, держать его открытым незачем
+            close_old_connections()
+
+    threading.Thread(target=run, name='counter-flush', daemon=True).start()
+    return stopped
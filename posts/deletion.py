@@ -0,0 +1,109 @@
+"""
+Удаление пользователей и сообществ в фоне.
+
+Обычный ``delete()`` собирает все каскадные строки в памяти и держит
+блокировку записи sqlite, пока не удалит их одной транзакцией. Здесь
+объект сразу скрывается: сообщество флагом ``is_deleted``, пользователь
+самой незавершённой задачей, так что его ``is_active`` остаётся в
+распоряжении администратора. Команда run_deletion_jobs удаляет
+зависимые строки порциями по ``chunk_size`` в коротких транзакциях,
+начиная с самых дальних по цепочке каскада, и сохраняет прогресс.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (ArchivedComment, ArchivedPost, Comment, DeletionJob,
+                     Follow, FollowSuggestion, Group, Post, PostScore,
+                     ProfileStats, Reaction, User)
+from .sharding import post_databases
+
+
+def schedule_user_deletion(user):
+    return DeletionJob.objects.create(kind=DeletionJob.USER,
+                                      object_id=user.pk)
+
+
+def schedule_group_deletion(group):
+    with transaction.atomic():
+        group.is_deleted = True
+        group.save(update_fields=['is_deleted'])
+        return DeletionJob.objects.create(kind=DeletionJob.GROUP,
+                                          object_id=group.pk)
+
+
+def _user_steps(user_id):
+    steps = [
+        FollowSuggestion.objects.filter(Q(user_id=user_id) |
+                                        Q(author_id=user_id)),
+        Follow.objects.filter(Q(user_id=user_id) | Q(author_id=user_id)),
+    ]
+    # комментарии и реакции пользователя могут быть в любом шарде
+    for using in post_databases():
+        posts = Post.objects.using(using).filter(author_id=user_id).values('pk')
+        steps += [
+            Reaction.objects.using(using).filter(
+                Q(user_id=user_id) | Q(post__in=posts)),
+            # сначала самые глубокие ответы, чтобы каскад по parent был небольшим
+            Comment.objects.using(using).filter(
+                Q(author_id=user_id) | Q(post__in=posts)).order_by('-depth'),
+            PostScore.objects.using(using).filter(post__in=posts),
+            Post.objects.using(using).filter(author_id=user_id),
+            ArchivedComment.objects.using(using).filter(
+                Q(author_id=user_id) | Q(post__author_id=user_id)),
+            ArchivedPost.objects.using(using).filter(author_id=user_id),
+        ]
+    return steps + [
+        ProfileStats.objects.filter(user_id=user_id),
+        User.objects.filter(pk=user_id),
+    ]
+
+
+def delete_in_chunks(queryset, chunk_size):
+    """Удаляет строки порциями, отдавая число удалённых на каждом шаге."""
+    model, using = queryset.model, queryset.db
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        with transaction.atomic(using=using):
+            model.objects.using(using).filter(pk__in=pks).delete()
+        yield len(pks)
+
+
+def _detach_group_posts(group_id, chunk_size):
+    # то же, что делает SET_NULL, но порциями
+    for using in post_databases():
+        for model in (Post, ArchivedPost):
+            posts = model.objects.using(using).filter(group_id=group_id)
+            while True:
+                pks = list(posts.values_list('pk', flat=True)[:chunk_size])
+                if not pks:
+                    break
+                with transaction.atomic(using=using):
+                    model.objects.using(using).filter(
+                        pk__in=pks).update(group=None)
+                yield len(pks)
+
+
+def run_job(job, chunk_size=500):
+    """
+    Выполняет задачу, отдавая прогресс после каждой порции. Прерванная
+    задача при следующем запуске продолжит с того места, где остановилась.
+    """
+    if job.kind == DeletionJob.USER:
+        chunks = (count for queryset in _user_steps(job.object_id)
+                  for count in delete_in_chunks(queryset, chunk_size))
+    else:
+        chunks = (count for step in (
+            _detach_group_posts(job.object_id, chunk_size),
+            delete_in_chunks(Group.objects.filter(pk=job.object_id),
+                             chunk_size),
+        ) for count in step)
+    for count in chunks:
+        job.processed += count
+        job.save(update_fields=['processed'])
+        yield job
+    job.finished = timezone.now()
+    job.save(update_fields=['finished'])
+    yield job
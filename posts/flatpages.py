@@ -0,0 +1,97 @@
+"""
+Статические страницы из django.contrib.flatpages без запросов к базе.
+
+Все страницы сайта читаются одним запросом при первом обращении и
+хранятся в памяти процесса, а страница для анонимного посетителя
+рендерится один раз: у анонимов она одинаковая. Авторизованным шаблон
+рендерится на каждом запросе (в шапке их имя), но страница всё равно
+берётся из памяти. Ответ получает ETag, повторный запрос с ним — 304.
+
+Сохранение и удаление FlatPage и смена её сайтов записывают в общий кеш
+новую случайную версию; каждый процесс сверяет её на запросе и при
+расхождении забывает свои страницы. Версия случайная, а не счётчик,
+чтобы после очистки кеша процесс не принял старые страницы за свежие.
+Правки мимо сигналов (update() из консоли, загрузка фикстур) версию не
+меняют, поэтому страницы в памяти процесса живут не дольше
+FLATPAGES_LOCAL_TIMEOUT секунд.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.flatpages.views import render_flatpage
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+
+VERSION_KEY = 'flatpages_version'
+
+_lock = threading.Lock()
+_state = {'version': None, 'expires': 0, 'pages': {}, 'rendered': {}}
+
+
+def invalidate_flatpages():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _current_state():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    now = time.monotonic()
+    with _lock:
+        if _state['version'] != version or _state['expires'] < now:
+            _state.update(version=version, pages={}, rendered={},
+                          expires=now + settings.FLATPAGES_LOCAL_TIMEOUT)
+        return _state
+
+
+def site_pages(site_id):
+    """Страницы сайта по адресу."""
+    state = _current_state()
+    pages = state['pages'].get(site_id)
+    if pages is None:
+        pages = {page.url: page
+                 for page in FlatPage.objects.filter(sites=site_id)}
+        state['pages'][site_id] = pages
+    return pages
+
+
+def _render_anonymous(request, site_id, page):
+    state = _current_state()
+    key = (site_id, page.url)
+    if key not in state['rendered']:
+        response = render_flatpage(request, page)
+        state['rendered'][key] = response.content
+    return HttpResponse(state['rendered'][key])
+
+
+def flatpage(request, url):
+    """Замена django.contrib.flatpages.views.flatpage с тем же поведением."""
+    if not url.startswith('/'):
+        url = '/' + url
+    site_id = get_current_site(request).id
+    pages = site_pages(site_id)
+    page = pages.get(url)
+    if page is None:
+        if not url.endswith('/') and settings.APPEND_SLASH and \
+                url + '/' in pages:
+            return HttpResponsePermanentRedirect('%s/' % request.path)
+        raise Http404('Страница не найдена')
+
+    if request.user.is_authenticated or page.registration_required:
+        response = render_flatpage(request, page)
+    else:
+        response = _render_anonymous(request, site_id, page)
+    patch_vary_headers(response, ('Cookie',))
+    if response.status_code != 200:
+        return response
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
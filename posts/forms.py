@@ -1,5 +1,7 @@
 from django.db import models
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
+from posts.images import process_image
 from posts.models import Post, Group, Comment
 from django import forms
 
@@ -19,6 +21,25 @@ class PostForm(ModelForm):
         help_texts = {
             "text": "Введите текст вашего поста"
         }
+        error_messages = {
+            "image": {
+                "invalid_image": "Вы загрузили не изображение = ( /"
+                                 " You didnt upload an image = (",
+            },
+        }
+
+    def clean_image(self):
+        image = self.cleaned_data.get("image")
+        if image is False:
+            # отмечено «очистить»
+            self.instance.image_width = self.instance.image_height = None
+            self.instance.image_format = ""
+        elif isinstance(image, UploadedFile):
+            image, width, height, image_format = process_image(image)
+            self.instance.image_width = width
+            self.instance.image_height = height
+            self.instance.image_format = image_format
+        return image
 
 
 class CommentForm(ModelForm):
@@ -0,0 +1,163 @@
+"""
+Обработка загруженных изображений записей.
+
+Файл загрузки пишется на диск (TemporaryFileUploadHandler), проверяется
+Pillow, большие снимки уменьшаются до POST_IMAGE_MAX_SIZE по большей
+стороне, а EXIF (с координатами съёмки) отбрасывается после поворота по
+ориентации. Ширина, высота и формат сохраняются в записи, чтобы вёрстке
+и миниатюрам не приходилось декодировать файл заново.
+
+Для карточки в ленте один раз после сохранения строятся копии нескольких
+ширин (POST_IMAGE_WIDTHS) в WebP и в JPEG или PNG для старых браузеров;
+они записываются в ImageDerivative и попадают в srcset.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps, features
+
+from .models import ImageDerivative
+
+# форматы, которые храним как есть; остальные пересохраняются в PNG
+KEPT_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# карточка обрезает изображение до 960x339, как и миниатюра sorl
+CARD_ASPECT = 339 / 960
+DERIVATIVES_DIR = 'posts/derivatives'
+
+
+def open_image(upload):
+    """Открывает загрузку без чтения в память: у временного файла есть путь."""
+    if hasattr(upload, 'temporary_file_path'):
+        return Image.open(upload.temporary_file_path())
+    upload.seek(0)
+    return Image.open(upload)
+
+
+def process_image(upload):
+    """
+    Возвращает ``(файл, ширина, высота, формат)``. Если изображение не
+    нужно ни уменьшать, ни очищать от EXIF, возвращается исходный файл.
+    """
+    with open_image(upload) as image:
+        return _process(upload, image)
+
+
+def _process(upload, image):
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    width, height = image.size
+    # размер известен из заголовка, до декодирования пикселей
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError('Изображение слишком большое', code='too_large')
+    image_format = image.format
+    animated = getattr(image, 'is_animated', False)
+    oversized = max(width, height) > max_size
+    if not oversized and (animated or (
+            image_format in KEPT_FORMATS and 'exif' not in image.info)):
+        return upload, width, height, image_format
+
+    if image_format == 'JPEG':
+        # JPEG умеет декодироваться сразу в уменьшенном масштабе
+        image.draft('RGB', (max_size, max_size))
+    icc_profile = image.info.get('icc_profile')
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    for key in ('exif', 'XML:com.adobe.xmp'):
+        image.info.pop(key, None)
+    if image_format not in KEPT_FORMATS:
+        image_format = 'PNG'
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+        options.update(quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+    name = os.path.splitext(upload.name)[0] + KEPT_FORMATS[image_format]
+    result = TemporaryUploadedFile(name, Image.MIME[image_format], 0, None)
+    image.save(result, image_format, **options)
+    result.size = result.tell()
+    result.seek(0)
+    width, height = image.size
+    return result, width, height, image_format
+
+
+def _save_options(image_format):
+    if image_format == 'WEBP':
+        return {'quality': WEBP_QUALITY, 'method': 6}
+    if image_format == 'JPEG':
+        return {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+    return {'optimize': True}
+
+
+def _variants(image):
+    """Отдаёт ``(ширина, изображение)`` от большей ширины к меньшей."""
+    image = ImageOps.exif_transpose(image)
+    widths = sorted((width for width in settings.POST_IMAGE_WIDTHS
+                     if width <= image.width), reverse=True)
+    # узкие изображения не растягиваем: одна копия в исходную ширину
+    widths = widths or [image.width]
+    # обрезка и самое дорогое уменьшение делаются один раз, меньшие
+    # ширины получаются из уже обрезанной копии
+    variant = ImageOps.fit(
+        image, (widths[0], max(round(widths[0] * CARD_ASPECT), 1)),
+        Image.LANCZOS)
+    for width in widths:
+        if width != variant.width:
+            variant = variant.resize(
+                (width, max(round(width * CARD_ASPECT), 1)), Image.LANCZOS)
+        yield width, variant
+
+
+def build_derivatives(post):
+    """
+    Строит копии изображения записи, если их ещё нет для текущего файла.
+    Копии прежнего изображения удаляются, их файлы отпускает сигнал
+    post_delete. Файл, который не удалось открыть, пропускается: карточка
+    покажет миниатюру sorl.
+    """
+    if not post.image:
+        return []
+    source = post.image.name
+    if post.derivatives.filter(source=source).exists():
+        return []
+    post.derivatives.exclude(source=source).delete()
+
+    storage = post.image.storage
+    stem = os.path.splitext(os.path.basename(source))[0]
+    rows = []
+    try:
+        post.image.open('rb')
+        with Image.open(post.image) as image:
+            has_alpha = image.mode in ('RGBA', 'LA') or \
+                'transparency' in image.info
+            fallback = 'PNG' if has_alpha else 'JPEG'
+            formats = [fallback]
+            if features.check('webp'):
+                formats.insert(0, 'WEBP')
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            for width, variant in _variants(image):
+                for image_format in formats:
+                    buffer = BytesIO()
+                    variant.save(buffer, image_format,
+                                 **_save_options(image_format))
+                    name = storage.save(
+                        f'{DERIVATIVES_DIR}/{stem}-{width}'
+                        f'{KEPT_FORMATS[image_format]}',
+                        ContentFile(buffer.getvalue()))
+                    rows.append(ImageDerivative(
+                        post=post, source=source, file=name,
+                        format=image_format, width=variant.width,
+                        height=variant.height, size=buffer.tell()))
+    except (OSError, ValueError, SuspiciousFileOperation):
+        # файла нет в хранилище, путь вне MEDIA_ROOT или это не изображение;
+        # строки копий ещё не сохранены, поэтому файлы отпускаются здесь
+        for row in rows:
+            storage.delete(row.file.name)
+        return []
+    finally:
+        post.image.close()
+    return ImageDerivative.objects.using(post._state.db).bulk_create(rows)
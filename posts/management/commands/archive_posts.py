@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.archive import archive_posts
+
+
+class Command(BaseCommand):
+    help = "Переносит старые записи с комментариями в архивные таблицы"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int,
+                            default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Возраст записи в днях, после которого она уходит в архив")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Сколько записей переносить в одной транзакции")
+
+    def handle(self, *args, **options):
+        total = 0
+        for count in archive_posts(options["days"], options["chunk_size"]):
+            total += count
+            self.stdout.write(f"перенесено записей: {total}")
+        self.stdout.write(self.style.SUCCESS(f"В архиве новых записей: {total}"))
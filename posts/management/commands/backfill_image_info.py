@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts.models import ArchivedPost, Post
+from posts.sharding import post_databases
+
+
+class Command(BaseCommand):
+    help = ("Записывает размеры и формат изображений, загруженных до "
+            "обработки при загрузке, во всех шардах и в архиве. Читается "
+            "только заголовок файла")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Сколько записей обновлять за раз")
+
+    def handle(self, *args, **options):
+        total = missing = 0
+        for using in post_databases():
+            for model in (Post, ArchivedPost):
+                updated, unread = self.backfill(
+                    model.objects.using(using), options["chunk_size"])
+                total += updated
+                missing += unread
+        self.stdout.write(self.style.SUCCESS(
+            f"Обновлено записей: {total}, файлы не прочитаны: {missing}"))
+
+    def backfill(self, queryset, chunk_size):
+        posts = queryset.exclude(image="").filter(
+            image__isnull=False, image_format="").only("id", "image")
+        batch, total, missing = [], 0, 0
+        for post in posts.iterator():
+            try:
+                with post.image.open() as file, Image.open(file) as image:
+                    post.image_width, post.image_height = image.size
+                    post.image_format = image.format
+            except (OSError, ValueError):
+                missing += 1
+                continue
+            batch.append(post)
+            if len(batch) == chunk_size:
+                total += self.save(queryset, batch)
+                batch = []
+        total += self.save(queryset, batch)
+        return total, missing
+
+    @staticmethod
+    def save(queryset, batch):
+        queryset.bulk_update(
+            batch, ["image_width", "image_height", "image_format"])
+        return len(batch)
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from posts.images import build_derivatives
+from posts.models import ImageDerivative, Post
+from posts.sharding import post_databases
+
+
+def percent(part, whole):
+    return f"{100 * (1 - part / whole):5.1f}%" if whole else "    -"
+
+
+class Command(BaseCommand):
+    help = ("Строит копии изображений записей для srcset там, где их ещё "
+            "нет, и печатает, сколько байт они экономят")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--report-only", action="store_true",
+                            help="Только отчёт, без построения копий")
+
+    def handle(self, *args, **options):
+        built = missing = original = 0
+        totals = defaultdict(lambda: defaultdict(int))
+        for using in post_databases():
+            posts = Post.objects.using(using).exclude(image="").filter(
+                image__isnull=False).only("id", "image")
+            for post in posts.iterator():
+                if not options["report_only"]:
+                    built += bool(build_derivatives(post))
+                try:
+                    original += post.image.size
+                except (OSError, SuspiciousFileOperation):
+                    missing += 1
+            rows = ImageDerivative.objects.using(using).values(
+                "width", "format").annotate(size=Sum("size"))
+            for row in rows:
+                totals[row["width"]][row["format"]] += row["size"]
+
+        self.stdout.write(
+            f"Построено: {built}, файлы не найдены: {missing}, "
+            f"исходные изображения: {original} байт")
+        self.stdout.write("ширина    JPEG/PNG        WebP  экономия WebP  "
+                          "к исходным")
+        for width in sorted(totals):
+            sizes = totals[width]
+            webp = sizes.pop("WEBP", 0)
+            fallback = sum(sizes.values())
+            self.stdout.write(
+                f"{width:6d} {fallback:11d} {webp:11d}"
+                f"         {percent(webp, fallback)}      "
+                f"{percent(webp or fallback, original)}")
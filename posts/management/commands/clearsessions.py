@@ -0,0 +1,40 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ("Удаляет истёкшие сессии порциями, каждую в своей короткой "
+            "транзакции, а не одним DELETE по всей таблице")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        store = engine.SessionStore
+        if not hasattr(store, "get_model_class"):
+            # сессии не в базе: очистка как у встроенной команды
+            try:
+                store.clear_expired()
+            except NotImplementedError:
+                raise CommandError(
+                    "Session engine '%s' doesn't support clearing expired "
+                    "sessions." % settings.SESSION_ENGINE)
+            return
+
+        model = store.get_model_class()
+        expired = model.objects.filter(
+            expire_date__lt=timezone.now()).values_list("pk", flat=True)
+        total = 0
+        while True:
+            keys = list(expired[:options["chunk_size"]])
+            if not keys:
+                break
+            with transaction.atomic():
+                model.objects.filter(pk__in=keys).delete()
+            total += len(keys)
+        self.stdout.write(f"Удалено сессий: {total}")
@@ -0,0 +1,66 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import MEDIA_FIELDS, Blob
+from posts.sharding import post_databases
+from posts.storage import post_media_storage
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает ссылки на файлы хранилища изображений и удаляет "
+            "файлы, на которые не ссылается ни одна запись")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=int,
+                            default=settings.MEDIA_GC_GRACE_HOURS,
+                            help="Не трогать файлы, использованные недавно")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        references = Counter()
+        for using in post_databases():
+            for model, field in MEDIA_FIELDS.items():
+                names = model.objects.using(using).exclude(
+                    **{field: ""}).filter(**{f"{field}__isnull": False})
+                references.update(
+                    names.values_list(field, flat=True).iterator())
+
+        changed = []
+        for blob in Blob.objects.only("name", "refcount").iterator():
+            if blob.refcount != references[blob.name]:
+                blob.refcount = references[blob.name]
+                changed.append(blob)
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        if options["dry_run"]:
+            garbage = [blob for blob in Blob.objects.filter(
+                last_used__lt=cutoff).only("name", "size").iterator()
+                if not references[blob.name]]
+            self.stdout.write(
+                f"Ссылок исправить: {len(changed)}. Будет удалено файлов: "
+                f"{len(garbage)}, {sum(blob.size for blob in garbage)} байт")
+            return
+
+        Blob.objects.bulk_update(changed, ["refcount"],
+                                 batch_size=options["chunk_size"])
+        garbage = Blob.objects.filter(refcount=0, last_used__lt=cutoff)
+        removed = freed = 0
+        for blob in garbage.only("name", "size").iterator():
+            # загрузка, прошедшая во время пересчёта, обновила last_used,
+            # и тогда строка не удалится, а файл останется
+            if not garbage.filter(name=blob.name).delete()[0]:
+                continue
+            try:
+                os.remove(post_media_storage.path(blob.name))
+            except FileNotFoundError:
+                pass
+            removed += 1
+            freed += blob.size
+        self.stdout.write(self.style.SUCCESS(
+            f"Ссылок исправлено: {len(changed)}. Удалено файлов: {removed}, "
+            f"{freed} байт"))
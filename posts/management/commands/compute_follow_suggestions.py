@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Follow, FollowSuggestion
+from posts.recommendations import suggest_authors
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рекомендации авторов для подписки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10,
+                            help="Сколько рекомендаций хранить на пользователя")
+        parser.add_argument("--max-fanout", type=int, default=50,
+                            help="Сколько подписчиков автора учитывать")
+        parser.add_argument("--max-similar", type=int, default=20,
+                            help="Сколько похожих авторов хранить на автора")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        edges = Follow.objects.values_list("user_id", "author_id").iterator()
+        suggestions = [
+            FollowSuggestion(user_id=user_id, author_id=author_id, score=score)
+            for user_id, author_id, score in suggest_authors(
+                edges, top=options["top"], max_fanout=options["max_fanout"],
+                max_similar=options["max_similar"])
+        ]
+        with transaction.atomic():
+            FollowSuggestion.objects.all().delete()
+            FollowSuggestion.objects.bulk_create(
+                suggestions, batch_size=options["batch_size"])
+        self.stdout.write(f"Сохранено рекомендаций: {len(suggestions)}")
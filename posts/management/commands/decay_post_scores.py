@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts.trending import decay_scores
+
+
+class Command(BaseCommand):
+    help = "Затухание рейтинга обсуждаемых записей, запускается по расписанию"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=float, default=1,
+                            help="Сколько часов прошло с прошлого запуска")
+        parser.add_argument("--half-life", type=float, default=24,
+                            help="Период полураспада рейтинга в часах")
+        parser.add_argument("--min-score", type=float, default=0.01,
+                            help="Рейтинги ниже порога удаляются")
+
+    def handle(self, *args, **options):
+        factor = 0.5 ** (options["hours"] / options["half_life"])
+        updated, removed = decay_scores(factor, options["min_score"])
+        self.stdout.write(f"Обновлено: {updated}, удалено: {removed}")
@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.flatpages.models import FlatPage
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from posts.flatpages import flatpage
+
+
+class Command(BaseCommand):
+    help = ("Сохраняет статические страницы сайта в виде HTML-файлов "
+            "<каталог>/<адрес>/index.html, чтобы их отдавал веб-сервер")
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Каталог для файлов")
+
+    def handle(self, *args, **options):
+        pages = FlatPage.objects.filter(sites=settings.SITE_ID,
+                                        registration_required=False)
+        factory = RequestFactory()
+        exported = 0
+        for page in pages:
+            request = factory.get(page.url)
+            request.user = AnonymousUser()
+            response = flatpage(request, page.url)
+            if response.status_code != 200:
+                continue
+            directory = os.path.join(options["output"], page.url.strip("/"))
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, "index.html"), "wb") as file:
+                file.write(response.content)
+            exported += 1
+        self.stdout.write(f"Сохранено страниц: {exported}")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.sharding import author_loads, move_author, plan_moves, sync_replicas
+
+
+class Command(BaseCommand):
+    help = ("Выравнивает число записей в шардах, перенося авторов целиком. "
+            "Переносит и записи, созданные до включения шардирования")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="Допустимый перекос относительно среднего")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Только показать план переноса")
+
+    def handle(self, *args, **options):
+        if not settings.POST_SHARDS:
+            raise CommandError("Шардирование выключено: задайте YATUBE_POST_SHARDS")
+        sync_replicas()
+        moves = plan_moves(author_loads(), settings.POST_SHARDS,
+                           options["tolerance"])
+        for author_id, source, target in moves:
+            self.stdout.write(f"автор #{author_id}: {source} -> {target}")
+            if not options["dry_run"]:
+                move_author(author_id, source, target)
+        self.stdout.write(self.style.SUCCESS(f"Перенесено авторов: {len(moves)}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.deletion import run_job
+from posts.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = "Удаляет порциями пользователей и сообщества, помеченные на удаление"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Сколько строк удалять в одной транзакции")
+
+    def handle(self, *args, **options):
+        for job in DeletionJob.objects.filter(finished__isnull=True):
+            label = f"{job.get_kind_display()} #{job.object_id}"
+            for progress in run_job(job, options["chunk_size"]):
+                self.stdout.write(f"{label}: удалено строк {progress.processed}")
+            self.stdout.write(self.style.SUCCESS(f"{label}: готово"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.deletion import schedule_group_deletion, schedule_user_deletion
+from posts.models import Group, User
+
+
+class Command(BaseCommand):
+    help = "Скрывает пользователя или сообщество и ставит их в очередь на удаление"
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--user", help="username пользователя")
+        target.add_argument("--group", help="slug сообщества")
+
+    def handle(self, *args, **options):
+        try:
+            if options["user"]:
+                job = schedule_user_deletion(
+                    User.objects.get(username=options["user"]))
+            else:
+                job = schedule_group_deletion(
+                    Group.objects.get(slug=options["group"]))
+        except (User.DoesNotExist, Group.DoesNotExist) as error:
+            raise CommandError(error)
+        self.stdout.write(f"Задача #{job.pk} поставлена в очередь")
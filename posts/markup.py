@@ -0,0 +1,41 @@
+"""
+Разметка текста записи. HTML собирается один раз при сохранении и
+хранится в Post.text_html, поэтому лента не экранирует и не разбирает
+текст каждой карточки на каждом запросе. Ссылки, #теги и @упоминания
+становятся ссылками, переводы строк — тегами <br> как у linebreaksbr.
+"""
+import re
+
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.text import normalize_newlines
+
+TAG_RE = re.compile(r'(?<![\w&#])#(?P<tag>\w+)')
+MENTION_RE = re.compile(r'(?<![\w@])@(?P<mention>[\w.+-]*\w)')
+URL_RE = re.compile(r'(?P<url>https?://[^\s<>"]*[^\s<>"\'.,;:!?)\]])')
+# ссылки первыми, чтобы #якорь внутри адреса не стал тегом
+TOKEN_RE = re.compile('|'.join(
+    regex.pattern for regex in (URL_RE, TAG_RE, MENTION_RE)))
+
+
+def render_text(text):
+    parts = []
+    position = 0
+    text = normalize_newlines(text)
+    for match in TOKEN_RE.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        if match['url']:
+            link = format_html('<a href="{}" rel="nofollow">{}</a>',
+                               match['url'], match['url'])
+        elif match['tag']:
+            link = format_html(
+                '<a href="{}">{}</a>',
+                reverse('tag_posts', args=[match['tag'].lower()]), match.group())
+        else:
+            link = format_html(
+                '<a href="{}">{}</a>',
+                reverse('profile', args=[match['mention']]), match.group())
+        parts.append(link)
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts).replace('\n', '<br>')
@@ -0,0 +1,99 @@
+"""
+Сжатие HTML-ответов.
+
+GZipMiddleware сжимает всё длиннее 200 байт, включая картинки и файлы
+из posts.serving, у которых есть готовые .gz. Здесь сжимаются только
+текстовые ответы не короче GZIP_MIN_LENGTH; потоковые ответы сжимаются
+на лету по мере отдачи. Для каждого view копится, сколько байт было и
+сколько ушло: ``compression_report`` пишет это в лог при остановке
+воркера (yatube/wsgi.py).
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+COMPRESSED_TYPES = ('text/', 'application/json', 'application/javascript',
+                    'application/xml', 'image/svg+xml')
+
+logger = logging.getLogger(__name__)
+compression_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def _record(view, original, sent):
+    with _stats_lock:
+        stats = compression_stats[view]
+        stats['responses'] += 1
+        stats['original'] += original
+        stats['sent'] += sent
+
+
+class _Measured:
+    """Считает байты потокового ответа по мере отдачи."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
+
+
+def _measure_sent(view, source, chunks):
+    sent = 0
+    for chunk in chunks:
+        sent += len(chunk)
+        yield chunk
+    _record(view, source.size, sent)
+
+
+class CompressionMiddleware(GZipMiddleware):
+
+    def process_response(self, request, response):
+        if not self.should_compress(response):
+            return response
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else request.path
+        if not response.streaming:
+            original = len(response.content)
+            response = super().process_response(request, response)
+            _record(view, original, len(response.content))
+            return response
+        # GZipMiddleware оборачивает поток в compress_sequence, если
+        # клиент принимает gzip; байты считаются до и после сжатия
+        source = _Measured(response.streaming_content)
+        response.streaming_content = source
+        response = super().process_response(request, response)
+        response.streaming_content = _measure_sent(
+            view, source, response.streaming_content)
+        return response
+
+    @staticmethod
+    def should_compress(response):
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSED_TYPES):
+            return False
+        # у файлов из posts.serving диапазоны считаются по исходным байтам
+        if response.has_header('Accept-Ranges'):
+            return False
+        return response.streaming or \
+            len(response.content) >= settings.GZIP_MIN_LENGTH
+
+
+def compression_report():
+    with _stats_lock:
+        rows = sorted(compression_stats.items(),
+                      key=lambda item: item[1]['original'] - item[1]['sent'],
+                      reverse=True)
+    for view, stats in rows:
+        saved = stats['original'] - stats['sent']
+        logger.info(
+            "%s: ответов %d, %d -> %d байт, сэкономлено %d (%.1f%%)",
+            view, stats['responses'], stats['original'], stats['sent'], saved,
+            100 * saved / stats['original'] if stats['original'] else 0)
+    return rows
@@ -0,0 +1,66 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PATH_STEP = 6
+BATCH_SIZE = 500
+
+
+def encode_path_step(number):
+    digits = ''
+    while number:
+        number, rest = divmod(number, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[rest] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
+def fill_root_paths(apps, schema_editor):
+    # до этой миграции все комментарии были корневыми
+    Comment = apps.get_model('posts', 'Comment')
+    batch = []
+    for comment in Comment.objects.filter(path='').only('id').iterator():
+        comment.path = encode_path_step(comment.id)
+        batch.append(comment)
+        if len(batch) == BATCH_SIZE:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_comment_cursor_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_post_created_idx',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.Comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=246),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', '-created', '-id'], name='comment_thread_root_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_thread_path_idx'),
+        ),
+        migrations.RunPython(fill_root_paths, migrations.RunPython.noop),
+    ]
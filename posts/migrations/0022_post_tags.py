@@ -0,0 +1,80 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+TAG_RE = re.compile(r'(?<![\w&#])#(\w+)')
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]*\w)')
+BATCH_SIZE = 500
+
+
+def index_existing_posts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostTag = apps.get_model('posts', 'PostTag')
+    PostMention = apps.get_model('posts', 'PostMention')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    users = dict(User.objects.values_list('username', 'pk'))
+    tags, mentions = [], []
+    posts = Post.objects.only('id', 'text', 'pub_date', 'author_id')
+    for post in posts.iterator():
+        for name in {tag.lower()[:100] for tag in TAG_RE.findall(post.text)}:
+            tags.append(PostTag(post_id=post.id, name=name,
+                                pub_date=post.pub_date))
+        for name in set(MENTION_RE.findall(post.text)):
+            if users.get(name, post.author_id) != post.author_id:
+                mentions.append(PostMention(post_id=post.id, user_id=users[name],
+                                            pub_date=post.pub_date))
+        if len(tags) >= BATCH_SIZE or len(mentions) >= BATCH_SIZE:
+            PostTag.objects.bulk_create(tags, batch_size=BATCH_SIZE)
+            PostMention.objects.bulk_create(mentions, batch_size=BATCH_SIZE)
+            tags, mentions = [], []
+    PostTag.objects.bulk_create(tags, batch_size=BATCH_SIZE)
+    PostMention.objects.bulk_create(mentions, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0021_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('pub_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='posts.Post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostMention',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='posts.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['name', '-pub_date', '-post'], name='post_tag_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('post', 'name'), name='unique post tag'),
+        ),
+        migrations.AddIndex(
+            model_name='postmention',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='post_mention_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='postmention',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique post mention'),
+        ),
+        migrations.RunPython(index_existing_posts, migrations.RunPython.noop),
+    ]
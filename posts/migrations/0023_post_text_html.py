@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:29
+
+from django.db import migrations, models
+
+from posts.markup import render_text
+
+BATCH_SIZE = 500
+
+
+def render_existing_posts(apps, schema_editor):
+    # разметка — чистая функция текста, её можно взять из приложения
+    for name in ('Post', 'ArchivedPost'):
+        model = apps.get_model('posts', name)
+        batch = []
+        for post in model.objects.filter(text_html='').only('id', 'text').iterator():
+            post.text_html = render_text(post.text)
+            batch.append(post)
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_update(batch, ['text_html'])
+                batch = []
+        model.objects.bulk_update(batch, ['text_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpost',
+            name='text_html',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_existing_posts, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, router
+from django.db.models import Q
 from django.db.models.constraints import UniqueConstraint
+from django.utils import timezone
+
+from .markup import render_text
+from .storage import post_media_storage
 
 User = get_user_model()
 
@@ -9,38 +15,150 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    # сообщество скрыто и ждёт удаления фоновой задачей, см. posts.deletion
+    is_deleted = models.BooleanField(default=False)
 
     def __str__(self):
         return self.title
 
 
+def hide_deleted_authors(queryset):
+    """Строки ``queryset`` без неактивных авторов и авторов, ожидающих
+    удаления."""
+    from .caching import pending_user_deletions
+    queryset = queryset.filter(author__is_active=True)
+    pending = pending_user_deletions()
+    return queryset.exclude(author_id__in=pending) if pending else queryset
+
+
+class PostQuerySet(models.QuerySet):
+    def visible(self):
+        """Без записей скрытых авторов и записей в удалённых сообществах."""
+        return hide_deleted_authors(self).filter(
+            Q(group__isnull=True) | Q(group__is_deleted=False))
+
+
 class Post(models.Model):
+    # пишутся только сбросом буферов posts.counters
+    COUNTER_FIELDS = ('reaction_count', 'view_count')
+
     class Meta:
         ordering = ("-pub_date",)
 
+    objects = PostQuerySet.as_manager()
+
     text = models.TextField()
     pub_date = models.DateTimeField("date published",
-                                    auto_now_add=True)
+                                    auto_now_add=True, db_index=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="posts")
     group = models.ForeignKey(Group, on_delete=models.SET_NULL,
                               blank=True, null=True, related_name="posts_group")
-    image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    image = models.ImageField(upload_to="posts/", storage=post_media_storage,
+                              blank=True, null=True)
+    # заполняются при загрузке, см. posts.images
+    image_width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_format = models.CharField(max_length=10, blank=True, editable=False)
+    # HTML текста, собирается при сохранении, см. posts.markup
+    text_html = models.TextField(blank=True, editable=False)
+    # копится в памяти и сбрасывается пачками, см. posts.counters
+    reaction_count = models.PositiveIntegerField(default=0, editable=False)
+    view_count = models.PositiveIntegerField(default=0, editable=False)
+
+    is_archived = False
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and settings.POST_SHARDS:
+            allocate_id(self, kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # копия записи могла устареть, например в кеше объектов, и
+            # полное сохранение затёрло бы сброшенные с тех пор счётчики
+            update_fields = kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS]
+        if update_fields is None or 'text' in update_fields:
+            self.text_html = render_text(self.text)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'text_html'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.text
 
 
+def allocate_id(instance, save_kwargs):
+    """
+    id новой строки из общей для всех шардов последовательности и её
+    шард. QuerySet.create передаёт в save() using основной базы: без
+    объекта в подсказках роутеру не из чего выбрать шард.
+    """
+    from .sharding import next_id  # sharding импортирует модели
+    instance.pk = next_id(type(instance))
+    save_kwargs['force_insert'] = True
+    save_kwargs['using'] = router.db_for_write(type(instance),
+                                               instance=instance)
+
+
+def encode_path_step(number):
+    """Сегмент материализованного пути: id в base36 фиксированной ширины,
+    чтобы строковый порядок путей совпадал с порядком обхода дерева."""
+    digits = ''
+    while number:
+        number, rest = divmod(number, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[rest] + digits
+    return digits.rjust(Comment.PATH_STEP, '0')
+
+
 class Comment(models.Model):
+    PATH_STEP = 6
+    MAX_DEPTH = 40
+
     class Meta:
-        ordering = ("-created",)
+        ordering = ("-created", "-id")
+        indexes = [
+            models.Index(fields=["post", "depth", "-created", "-id"],
+                         name="comment_thread_root_idx"),
+            models.Index(fields=["post", "path"],
+                         name="comment_thread_path_idx"),
+        ]
 
     post = models.ForeignKey(Post, on_delete=models.CASCADE, verbose_name="Comment",
                              related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="comments_author")
     text = models.TextField()
-    created = models.DateTimeField("date published", auto_now_add=True)
+    created = models.DateTimeField("date published", auto_now_add=True,
+                                   db_index=True)
+    parent = models.ForeignKey("self", on_delete=models.CASCADE,
+                               blank=True, null=True, related_name="replies")
+    # путь от корня ветки: сегменты id предков и самого комментария
+    path = models.CharField(max_length=PATH_STEP * (MAX_DEPTH + 1),
+                            blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and settings.POST_SHARDS:
+            allocate_id(self, kwargs)
+        if self.parent_id is not None:
+            # слишком глубокий ответ становится соседом своего родителя
+            while self.parent.depth >= self.MAX_DEPTH:
+                self.parent = self.parent.parent
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if not self.path:
+            prefix = self.parent.path if self.parent_id is not None else ''
+            self.path = prefix + encode_path_step(self.pk)
+            Comment.objects.using(self._state.db).filter(
+                pk=self.pk).update(path=self.path)
+
+    def subtree_filter(self):
+        """Условие на всю ветку комментария: диапазон по индексу path
+        (символ '{' идёт сразу за 'z')."""
+        return models.Q(post_id=self.post_id, path__gte=self.path,
+                        path__lt=self.path + '{')
 
 
 class Follow(models.Model):
@@ -54,3 +172,213 @@ class Follow(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+
+
+class FollowSuggestion(models.Model):
+    """Рекомендация автора для подписки, считается командой
+    compute_follow_suggestions."""
+    class Meta:
+        ordering = ("-score",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "author", ],
+                name="unique suggestion user-author"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "-score"],
+                         name="suggestion_user_score_idx"),
+        ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="suggestions")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+
+class ProfileStats(models.Model):
+    """Счётчики страницы автора, строка создаётся при первом сбросе."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name="profile_stats")
+    views = models.PositiveIntegerField(default=0)
+
+
+class PostScore(models.Model):
+    """Рейтинг обсуждаемости записи: растёт от комментариев и просмотров
+    и периодически затухает командой decay_post_scores."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE,
+                                primary_key=True, related_name="score")
+    score = models.FloatField(default=0, db_index=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class Reaction(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post", ],
+                name="unique user-post reaction"
+            )
+        ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reactions")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="reactions")
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class DeletionJob(models.Model):
+    """Фоновое удаление пользователя или сообщества порциями."""
+    USER = "user"
+    GROUP = "group"
+    KIND_CHOICES = ((USER, "Пользователь"), (GROUP, "Сообщество"))
+
+    class Meta:
+        ordering = ("created",)
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True, db_index=True)
+    processed = models.PositiveIntegerField(default=0)
+
+
+class ArchivedPost(models.Model):
+    """Старая запись, перенесённая из posts_post командой archive_posts.
+    id сохраняется, чтобы постоянные ссылки продолжали работать."""
+    class Meta:
+        ordering = ("-pub_date",)
+
+    objects = PostQuerySet.as_manager()
+
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField()
+    pub_date = models.DateTimeField("date published", db_index=True)
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name="archived_posts")
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL,
+                              blank=True, null=True, related_name="archived_posts")
+    image = models.ImageField(upload_to="posts/", storage=post_media_storage,
+                              blank=True, null=True)
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    image_format = models.CharField(max_length=10, blank=True)
+    text_html = models.TextField(blank=True)
+    reaction_count = models.PositiveIntegerField(default=0)
+    view_count = models.PositiveIntegerField(default=0)
+
+    is_archived = True
+
+    def __str__(self):
+        return self.text
+
+
+class ArchivedComment(models.Model):
+    PATH_STEP = Comment.PATH_STEP
+
+    class Meta:
+        ordering = ("-created", "-id")
+        indexes = [
+            models.Index(fields=["post", "path"],
+                         name="archived_comment_path_idx"),
+        ]
+
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE,
+                             related_name="comments")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    text = models.TextField()
+    created = models.DateTimeField("date published")
+    parent_id = models.IntegerField(blank=True, null=True)
+    path = models.CharField(max_length=Comment._meta.get_field("path").max_length)
+    depth = models.PositiveSmallIntegerField(default=0)
+
+    subtree_filter = Comment.subtree_filter
+
+
+class PostTag(models.Model):
+    """Хештег записи. Дата копируется из записи, чтобы лента тега шла по
+    индексу (name, pub_date, post) без сортировки."""
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "name"],
+                                    name="unique post tag")
+        ]
+        indexes = [
+            models.Index(fields=["name", "-pub_date", "-post"],
+                         name="post_tag_feed_idx"),
+        ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="tag_links")
+    name = models.CharField(max_length=100)
+    pub_date = models.DateTimeField()
+
+
+class PostMention(models.Model):
+    """Упоминание пользователя через @ в тексте записи."""
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "user"],
+                                    name="unique post mention")
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="post_mention_feed_idx"),
+        ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="mentions")
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="mentions")
+    pub_date = models.DateTimeField()
+
+
+class ImageDerivative(models.Model):
+    """Уменьшенная копия изображения записи для srcset, см. posts.images.
+    ``source`` — имя файла изображения, из которого она сделана."""
+    class Meta:
+        ordering = ("width",)
+        constraints = [
+            models.UniqueConstraint(fields=["post", "source", "format", "width"],
+                                    name="unique image derivative")
+        ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="derivatives")
+    source = models.CharField(max_length=100)
+    file = models.FileField(upload_to="posts/derivatives/", max_length=200,
+                            storage=post_media_storage)
+    format = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+
+
+class Blob(models.Model):
+    """Файл хранилища posts.storage и число ссылок на него."""
+    name = models.CharField(max_length=200, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    # недавно загруженный файл не удаляется, даже если ссылок ещё нет
+    last_used = models.DateTimeField(default=timezone.now)
+
+
+class AuthorShard(models.Model):
+    """Карта шардов: в какой базе лежат записи автора, см. posts.sharding."""
+    author = models.OneToOneField(User, on_delete=models.CASCADE,
+                                  primary_key=True, related_name="+")
+    shard = models.CharField(max_length=50, db_index=True)
+
+
+class IdBlock(models.Model):
+    """Следующий свободный id записей или комментариев во всех шардах."""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_id = models.BigIntegerField()
+
+
+# поля, которые ссылаются на файлы хранилища posts.storage
+MEDIA_FIELDS = {Post: 'image', ArchivedPost: 'image', ImageDerivative: 'file'}
+
+
+def media_names(rows):
+    """Имена файлов хранилища, на которые ссылаются строки ``rows``."""
+    return [getattr(row, MEDIA_FIELDS[type(row)]).name for row in rows]
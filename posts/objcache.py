@@ -0,0 +1,159 @@
+"""
+Кеш объектов для поиска записи, автора и сообщества по адресу страницы.
+
+Два уровня: небольшой LRU в памяти процесса с коротким сроком жизни
+OBJECT_CACHE_LOCAL_TIMEOUT и общий кеш Django. Объект хранится под
+ключом по первичному ключу, а поиск по полю (username, slug) — ссылка
+«значение -> pk». После переименования старая ссылка ведёт на объект с
+другим значением поля и считается промахом, поэтому при сохранении
+достаточно удалить ключи текущего значения и pk. Ненайденные значения
+тоже кешируются: создание объекта с таким значением удаляет ключ.
+
+Ключи общего кеша версионируются OBJECT_CACHE_VERSION: после изменения
+полей моделей версия поднимается, и старые объекты не распаковываются.
+Другие процессы узнают об изменении не позже чем через
+OBJECT_CACHE_LOCAL_TIMEOUT секунд, свой процесс — сразу.
+
+Локальный уровень хранит объекты в pickle, как LocMemCache: каждый
+запрос получает свою копию и может её менять.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Group, Post, User
+
+MISSING = 'missing'
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectCache:
+
+    def __init__(self, model, field=None):
+        self.model = model
+        self.field = field
+        self.label = model._meta.label_lower
+        self.stats = Counter()
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, name, value):
+        return f'obj:{self.label}:{name}:{value}'
+
+    def _local_get(self, key):
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires, data = item
+            if expires < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+        return pickle.loads(data)
+
+    def _local_set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = time.monotonic() + settings.OBJECT_CACHE_LOCAL_TIMEOUT
+        with self._lock:
+            self._local[key] = (expires, data)
+            self._local.move_to_end(key)
+            while len(self._local) > settings.OBJECT_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def _get(self, key, load):
+        value = self._local_get(key)
+        if value is not None:
+            self.stats['local'] += 1
+            return value
+        value = cache.get(key, version=settings.OBJECT_CACHE_VERSION)
+        if value is not None:
+            self.stats['shared'] += 1
+            self._local_set(key, value)
+            return value
+        self.stats['miss'] += 1
+        value = load()
+        if value is None:
+            value = MISSING
+        self._set(key, value)
+        return value
+
+    def _set(self, key, value):
+        cache.set(key, value, settings.OBJECT_CACHE_TIMEOUT,
+                  version=settings.OBJECT_CACHE_VERSION)
+        self._local_set(key, value)
+
+    def get(self, pk, using=None):
+        """Объект по первичному ключу или None."""
+        def load():
+            queryset = self.model._default_manager.using(using)
+            return queryset.filter(pk=pk).first()
+        value = self._get(self._key('pk', pk), load)
+        return None if value == MISSING else value
+
+    def get_by(self, value):
+        """Объект по значению поля ``field`` или None."""
+        def load():
+            # объект загружается целиком и сразу кладётся под pk, чтобы
+            # промах по ссылке стоил один запрос, а не два
+            instance = self.model._default_manager.filter(
+                **{self.field: value}).first()
+            if instance is None:
+                return None
+            self._set(self._key('pk', instance.pk), instance)
+            return instance.pk
+        pk = self._get(self._key(self.field, value), load)
+        if pk == MISSING:
+            return None
+        instance = self.get(pk)
+        if instance is None or getattr(instance, self.field) != value:
+            # объект переименован или удалён, ссылка устарела
+            self.forget(self._key(self.field, value))
+            return None
+        return instance
+
+    def forget(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        cache.delete_many(keys, version=settings.OBJECT_CACHE_VERSION)
+
+    def invalidate(self, instance):
+        keys = [self._key('pk', instance.pk)]
+        if self.field:
+            keys.append(self._key(self.field, getattr(instance, self.field)))
+        self.forget(*keys)
+
+    def invalidate_pks(self, pks):
+        self.forget(*(self._key('pk', pk) for pk in pks))
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def hit_rate(self):
+        total = sum(self.stats.values())
+        hits = self.stats['local'] + self.stats['shared']
+        return hits / total if total else 0
+
+
+post_cache = ObjectCache(Post)
+user_cache = ObjectCache(User, 'username')
+group_cache = ObjectCache(Group, 'slug')
+OBJECT_CACHES = {object_cache.model: object_cache
+                 for object_cache in (post_cache, user_cache, group_cache)}
+
+
+def object_cache_report():
+    for object_cache in OBJECT_CACHES.values():
+        stats = object_cache.stats
+        logger.info(
+            "%s: из памяти %d, из кеша %d, из базы %d, попаданий %.1f%%",
+            object_cache.label, stats['local'], stats['shared'],
+            stats['miss'], 100 * object_cache.hit_rate())
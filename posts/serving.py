@@ -0,0 +1,196 @@
+"""
+Отдача файлов media и static.
+
+django.views.static.serve рассчитан на разработку: он не понимает Range
+(видео и большие файлы качаются целиком), проверяет только
+If-Modified-Since и не даёт заголовков кеширования. Здесь файл
+отдаётся так:
+
+* ETag и Last-Modified, ответы 304 и 412 через get_conditional_response;
+* один диапазон Range (с If-Range) — ответ 206, неверный диапазон — 416;
+* файлы с хешем содержимого в имени (posts.storage, ManifestStaticFilesStorage)
+  кешируются на год с immutable, остальные проверяются по ETag;
+* если рядом лежит сжатая при collectstatic копия .gz, а клиент принимает
+  gzip, отдаётся она (см. posts.staticfiles);
+* тело отдаёт сервер: при SENDFILE_BACKEND = 'x-accel' или 'x-sendfile'
+  Django отвечает только заголовком для nginx или apache, иначе целый файл
+  уходит через wsgi.file_wrapper, который у gunicorn вызывает os.sendfile.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+# sha256 из posts.storage или 12 знаков md5 из ManifestStaticFilesStorage
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$|\.[0-9a-f]{12}\.\w+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class RangeFile:
+    """Читает из файла не больше ``length`` байт начиная с ``start``.
+    У обёртки нет fileno, поэтому file_wrapper сервера не отправит
+    файл целиком."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """``(начало, длина)`` одного диапазона, None — отдать файл целиком,
+    ValueError — диапазон за концом файла."""
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        # несколько диапазонов не поддерживаются, RFC 7233 разрешает
+        # ответить на них целым файлом
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        if not length:
+            raise ValueError
+        return size - length, length
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        if first < size:
+            return None
+        raise ValueError
+    return first, last - first + 1
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.META.get('HTTP_IF_RANGE')
+    if value is None:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    return parse_http_date_safe(value) == int(mtime)
+
+
+def serve(request, path, document_root=None, accel_location=None):
+    try:
+        fullpath = safe_join(document_root, posixpath.normpath(path).lstrip('/'))
+        stat_result = os.stat(fullpath)
+    except (SuspiciousFileOperation, ValueError, OSError):
+        raise Http404('Файл не найден')
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404('Файл не найден')
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    # имя проверяется до подмены на сжатую копию: у .gz хеш не в конце
+    immutable = HASHED_NAME_RE.search(path)
+    compressed = _compressed_sibling(fullpath)
+    if compressed and ACCEPTS_GZIP_RE.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        fullpath, stat_result = compressed
+        path, encoding = path + '.gz', 'gzip'
+
+    size, mtime = stat_result.st_size, stat_result.st_mtime
+    etag = quote_etag(f'{int(mtime):x}-{size:x}')
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(mtime))
+    if response is None:
+        response = _file_response(request, fullpath, size, etag, mtime,
+                                  content_type, accel_location, path)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if compressed:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if immutable:
+        patch_cache_control(response, public=True, immutable=True,
+                            max_age=IMMUTABLE_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True,
+                            max_age=settings.SERVE_MAX_AGE)
+    return response
+
+
+def _compressed_sibling(fullpath):
+    try:
+        stat_result = os.stat(fullpath + '.gz')
+    except OSError:
+        return None
+    return fullpath + '.gz', stat_result
+
+
+def _file_response(request, fullpath, size, etag, mtime, content_type,
+                   accel_location, path):
+    backend = settings.SENDFILE_BACKEND
+    if backend == 'x-accel' and accel_location:
+        # nginx сам разберёт Range и отдаст файл из internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(accel_location + path)
+        return response
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+        return response
+
+    byte_range = None
+    if request.method in ('GET', 'HEAD') and \
+            if_range_matches(request, etag, mtime):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, length = byte_range
+        response = FileResponse(RangeFile(file, start, length),
+                                status=206, content_type=content_type)
+        response['Content-Range'] = \
+            f'bytes {start}-{start + length - 1}/{size}'
+        response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def file_urls(prefix, document_root):
+    """
+    Маршрут для отдачи файлов из ``document_root`` по адресу ``prefix``,
+    как django.conf.urls.static.static, но и при выключенном DEBUG.
+    Адрес на другом домене (CDN) отдаёт не Django, маршрута нет.
+    """
+    if not prefix or urlsplit(prefix).netloc:
+        return []
+    accel_location = settings.SENDFILE_ACCEL_PREFIX.rstrip('/') + prefix
+    return [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(prefix.lstrip('/')), serve,
+                kwargs={'document_root': document_root,
+                        'accel_location': accel_location}),
+    ]
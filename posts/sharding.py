@@ -0,0 +1,365 @@
+"""
+Шардирование записей по автору.
+
+Одна база sqlite — это один писатель на весь сайт. Если задан
+POST_SHARDS, записи автора, комментарии к ним, реакции, рейтинг и архив
+живут в одной из баз-шардов, выбранной по карте AuthorShard, а подписки,
+сессии и прочее остаются в основной базе. Пользователи и сообщества
+копируются во все шарды сигналами, поэтому внешние ключи и
+select_related('author') работают внутри шарда.
+
+- запросы, привязанные к объекту (``user.posts``, ``post.comments``,
+  сохранение записи или комментария), направляет PostShardRouter;
+- страница автора и запись читают один шард;
+- общие ленты собираются из всех шардов: ShardedFeed параллельно берёт
+  начало ленты каждого шарда и сливает их heapq.merge по дате;
+- id записей и комментариев выдаются блоками из IdBlock в основной базе,
+  так что они уникальны во всех шардах и не меняются при переносе
+  автора командой rebalance_shards.
+
+Без POST_SHARDS роутер ничего не решает и всё работает как раньше.
+"""
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, F, Max
+
+from .models import (MEDIA_FIELDS, ArchivedComment, ArchivedPost,
+                     AuthorShard, Comment, Group, IdBlock, ImageDerivative,
+                     Post, PostMention, PostScore, PostTag, Reaction, User,
+                     media_names)
+from .storage import change_references
+
+SHARDED_MODELS = (Post, Comment, Reaction, PostScore, PostTag, PostMention,
+                  ImageDerivative, ArchivedPost, ArchivedComment)
+# на id этих строк никто не ссылается, при переносе в шарде выдаются новые
+ID_FREE_MODELS = (Reaction, PostTag, PostMention, ImageDerivative)
+# архив сохраняет id, поэтому новые id выдаются и после архивных
+ARCHIVES = {Post: ArchivedPost, Comment: ArchivedComment}
+ID_BLOCK_SIZE = 100
+SHARD_KEY = 'shard:author:{}'
+SHARD_TIMEOUT = 60 * 60
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def post_databases():
+    """Базы, в которых лежат записи."""
+    return list(settings.POST_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def databases_for(model):
+    return post_databases() if model in SHARDED_MODELS else [DEFAULT_DB_ALIAS]
+
+
+def shard_for(author_id):
+    """Шард с записями автора; новому автору он назначается по id."""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    alias = cache.get(SHARD_KEY.format(author_id))
+    if alias is None:
+        shards = settings.POST_SHARDS
+        placement, _ = AuthorShard.objects.get_or_create(
+            author_id=author_id,
+            defaults={'shard': shards[author_id % len(shards)]})
+        alias = placement.shard
+        cache.set(SHARD_KEY.format(author_id), alias, SHARD_TIMEOUT)
+    return alias
+
+
+def forget_shard(author_id):
+    cache.delete(SHARD_KEY.format(author_id))
+
+
+def shard_for_username(username):
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    return shard_for(author_id) if author_id else DEFAULT_DB_ALIAS
+
+
+def locate_post(post_id):
+    """Шард записи, когда известен только её id."""
+    for alias in post_databases():
+        if Post.objects.using(alias).filter(pk=post_id).exists():
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class IdAllocator:
+    """Выдаёт id из блоков по ID_BLOCK_SIZE, резервируя блок одним UPDATE."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def next_id(self, model):
+        name = model._meta.label_lower
+        with self._lock:
+            next_id, limit = self._blocks.get(name, (0, 0))
+            if next_id >= limit:
+                next_id = self._reserve(model)
+                limit = next_id + ID_BLOCK_SIZE
+            self._blocks[name] = (next_id + 1, limit)
+            return next_id
+
+    def _reserve(self, model):
+        name = model._meta.label_lower
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            if not IdBlock.objects.filter(name=name).update(
+                    next_id=F('next_id') + ID_BLOCK_SIZE):
+                # первый блок начинается после строк, созданных до шардирования
+                start = 1 + max(
+                    table._base_manager.using(alias).aggregate(
+                        top=Max('pk'))['top'] or 0
+                    for table in (model, ARCHIVES[model])
+                    for alias in [DEFAULT_DB_ALIAS] + post_databases())
+                try:
+                    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                        IdBlock.objects.create(
+                            name=name, next_id=start + ID_BLOCK_SIZE)
+                    return start
+                except IntegrityError:
+                    IdBlock.objects.filter(name=name).update(
+                        next_id=F('next_id') + ID_BLOCK_SIZE)
+            return IdBlock.objects.get(name=name).next_id - ID_BLOCK_SIZE
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+allocator = IdAllocator()
+next_id = allocator.next_id
+
+
+class PostShardRouter:
+    """Направляет запросы к записям в шард по объекту из подсказок."""
+
+    def _route(self, model, instance):
+        if not enabled() or model not in SHARDED_MODELS or instance is None:
+            return None
+        if isinstance(instance, User):
+            return shard_for(instance.pk)
+        if type(instance) not in SHARDED_MODELS:
+            # например group.posts_group: такие ленты собирает ShardedFeed
+            return None
+        if not instance._state.adding:
+            return instance._state.db
+        # у новой строки _state.db мог выставить дескриптор связи, например
+        # при присвоении сообщества, поэтому шард выбирается заново
+        if isinstance(instance, (Post, ArchivedPost)):
+            return shard_for(instance.author_id)
+        # остальные строки живут рядом со своей записью
+        post = type(instance).post.field.get_cached_value(instance, None)
+        if post is not None:
+            return post._state.db or shard_for(post.author_id)
+        return locate_post(instance.post_id)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # пользователи и сообщества есть в каждой базе
+        if enabled():
+            return True
+        return None
+
+
+def replicate(instance, using):
+    """Копирует пользователя или сообщество из основной базы в шарды."""
+    if not enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    for alias in settings.POST_SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            type(instance)._base_manager.using(alias).update_or_create(
+                pk=instance.pk,
+                defaults={field.attname: getattr(instance, field.attname)
+                          for field in instance._meta.concrete_fields
+                          if not field.primary_key})
+
+
+def replicate_delete(instance, using):
+    if not enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    for alias in settings.POST_SHARDS:
+        if alias != DEFAULT_DB_ALIAS:
+            type(instance)._base_manager.using(alias).filter(
+                pk=instance.pk).delete()
+
+
+def scatter(func, aliases):
+    """Выполняет ``func(alias)`` для каждой базы параллельно."""
+    global _pool
+    if len(aliases) == 1:
+        return [func(aliases[0])]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=len(settings.POST_SHARDS),
+                                       thread_name_prefix='shard')
+    return list(_pool.map(func, aliases))
+
+
+def merge_slices(parts, start, stop, key, reverse=True):
+    """Срез [start:stop] слияния уже упорядоченных частей."""
+    return list(islice(heapq.merge(*parts, key=key, reverse=reverse),
+                       start, stop))
+
+
+class ShardedFeed:
+    """
+    Лента из всех шардов для Paginator. Каждый queryset в каждом шарде
+    отдаёт свои первые ``stop`` строк, а нужный срез вырезается из их
+    слияния по ``key``, поэтому порядок querysets должен совпадать с
+    ``key``, а строки разных querysets — не повторяться.
+    """
+
+    def __init__(self, querysets, key=attrgetter('pub_date')):
+        self.querysets = querysets
+        self.key = key
+        self.aliases = post_databases()
+
+    def _parts(self, func):
+        per_alias = scatter(
+            lambda alias: [func(queryset.using(alias))
+                           for queryset in self.querysets],
+            self.aliases)
+        return [part for parts in per_alias for part in parts]
+
+    def count(self):
+        return sum(self._parts(lambda queryset: queryset.count()))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("ShardedFeed поддерживает только срезы")
+        start, stop = key.start or 0, key.stop
+        parts = self._parts(lambda queryset: list(queryset[:stop]))
+        return merge_slices(parts, start, stop, self.key)
+
+
+def sharded(*querysets, key=attrgetter('pub_date')):
+    """Лента из querysets по всем шардам или сам queryset, если он один,
+    а шардов нет."""
+    if not enabled() and len(querysets) == 1:
+        return querysets[0]
+    return ShardedFeed(querysets, key)
+
+
+def sync_replicas():
+    """Докопирует в шарды пользователей и сообщества, созданные до
+    включения шардирования."""
+    for alias in settings.POST_SHARDS:
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        for model in (User, Group):
+            existing = set(model._base_manager.using(alias).values_list(
+                'pk', flat=True))
+            missing = [obj for obj in model._base_manager.using(
+                DEFAULT_DB_ALIAS).iterator() if obj.pk not in existing]
+            model._base_manager.using(alias).bulk_create(missing, batch_size=500)
+
+
+def author_loads():
+    """{author_id: (шард, число записей)} по всем базам с записями."""
+    loads = {}
+    for alias in dict.fromkeys([DEFAULT_DB_ALIAS] + post_databases()):
+        rows = Post.objects.using(alias).order_by().values(
+            'author_id').annotate(posts=Count('pk'))
+        for row in rows:
+            loads[row['author_id']] = (alias, row['posts'])
+    return loads
+
+
+def plan_moves(loads, shards, tolerance=0.1):
+    """
+    Переносы авторов ``[(author_id, откуда, куда)]``, после которых
+    число записей в шардах различается не больше чем на ``tolerance`` от
+    среднего. Авторы из баз, которых нет в ``shards``, переносятся всегда.
+    """
+    totals = dict.fromkeys(shards, 0)
+    by_shard = {shard: [] for shard in shards}
+    moves = []
+    for author_id, (shard, posts) in sorted(loads.items()):
+        if shard not in totals:
+            target = min(totals, key=totals.get)
+            moves.append((author_id, shard, target))
+            shard = target
+        totals[shard] += posts
+        by_shard[shard].append((posts, author_id))
+    limit = tolerance * sum(totals.values()) / len(shards)
+    while True:
+        source = max(totals, key=totals.get)
+        target = min(totals, key=totals.get)
+        gap = totals[source] - totals[target]
+        if gap <= limit:
+            break
+        # самый крупный автор, перенос которого сокращает разрыв
+        candidates = [item for item in by_shard[source] if item[0] < gap]
+        if not candidates:
+            break
+        posts, author_id = max(candidates)
+        by_shard[source].remove((posts, author_id))
+        by_shard[target].append((posts, author_id))
+        totals[source] -= posts
+        totals[target] += posts
+        moves.append((author_id, source, target))
+    return moves
+
+
+def move_author(author_id, source, target):
+    """
+    Копирует записи автора со всем, что к ним привязано, из ``source`` в
+    ``target``, переключает карту шардов и удаляет строки из ``source``.
+    Записи, добавленные автором во время переноса, могут потеряться,
+    поэтому переносить лучше в спокойное время.
+    """
+    of_author = {'post__author_id': author_id}
+    posts = Post.objects.using(source).filter(author_id=author_id)
+    archived = ArchivedPost.objects.using(source).filter(author_id=author_id)
+    querysets = [
+        posts,
+        Comment.objects.using(source).filter(**of_author).order_by('depth'),
+        Reaction.objects.using(source).filter(**of_author),
+        PostScore.objects.using(source).filter(**of_author),
+        PostTag.objects.using(source).filter(**of_author),
+        PostMention.objects.using(source).filter(**of_author),
+        ImageDerivative.objects.using(source).filter(**of_author),
+        archived,
+        ArchivedComment.objects.using(source).filter(**of_author),
+    ]
+    with transaction.atomic(using=target):
+        names = []
+        for queryset in querysets:
+            rows = list(queryset)
+            if queryset.model in ID_FREE_MODELS:
+                for row in rows:
+                    row.pk = None
+            queryset.model.objects.using(target).bulk_create(
+                rows, batch_size=500)
+            if queryset.model in MEDIA_FIELDS:
+                names += media_names(rows)
+        # удаление из source отпустит эти файлы, копии в target их держат
+        transaction.on_commit(lambda: change_references(names, 1),
+                              using=target)
+    AuthorShard.objects.update_or_create(author_id=author_id,
+                                         defaults={'shard': target})
+    forget_shard(author_id)
+    with transaction.atomic(using=source):
+        # каскадом уходят комментарии, реакции и рейтинг
+        posts.delete()
+        archived.delete()
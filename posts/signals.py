@@ -0,0 +1,187 @@
+from django.contrib.flatpages.models import FlatPage
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .auth import invalidate_user
+from .caching import (add_followed_author, increment_feed_counts,
+                      invalidate_feed_counts, invalidate_group_stats,
+                      invalidate_pending_deletions, remove_followed_author,
+                      reset_followed_authors)
+from .flatpages import invalidate_flatpages
+from .images import build_derivatives
+from .models import (ArchivedPost, DeletionJob, Follow, Group,
+                     ImageDerivative, Post, User, media_names)
+from .objcache import OBJECT_CACHES
+from .sharding import replicate, replicate_delete
+from .storage import change_references
+from .tags import index_post
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def reset_group_stats(sender, **kwargs):
+    # создание, удаление и перенос записи в другое сообщество меняют счётчики
+    invalidate_group_stats()
+
+
+def post_feeds(post):
+    scopes = ['all', f'author:{post.author_id}']
+    if post.group_id:
+        scopes.append(f'group:{post.group_id}')
+    return scopes
+
+
+@receiver(post_save, sender=Post)
+def update_feed_counts(sender, instance, created, raw, update_fields,
+                       **kwargs):
+    if raw:
+        return
+    if created:
+        increment_feed_counts(*post_feeds(instance))
+    elif update_fields is None or 'group' in update_fields:
+        # запись могла перейти в другое сообщество; старое узнает об
+        # этом через FEED_COUNT_TIMEOUT
+        invalidate_feed_counts(*post_feeds(instance)[2:])
+
+
+@receiver(post_delete, sender=Post)
+def reset_feed_counts(sender, instance, **kwargs):
+    invalidate_feed_counts(*post_feeds(instance))
+
+
+@receiver(post_save, sender=User)
+def user_visibility_changed(sender, instance, update_fields, **kwargs):
+    # записи неактивного автора пропадают из лент
+    if update_fields is None or 'is_active' in update_fields:
+        invalidate_feed_counts('all')
+        invalidate_group_stats()
+
+
+@receiver(post_save, sender=DeletionJob)
+@receiver(post_delete, sender=DeletionJob)
+def deletion_jobs_changed(sender, instance, **kwargs):
+    if 'processed' in (kwargs.get('update_fields') or ()):
+        return
+    # записи пользователя, ожидающего удаления, пропадают из лент; после
+    # коммита ещё раз, как и для кеша пользователей
+    invalidate_pending_deletions()
+    invalidate_feed_counts('all')
+    invalidate_group_stats()
+    transaction.on_commit(invalidate_pending_deletions)
+
+
+@receiver(post_save, sender=Post)
+def update_post_tags(sender, instance, created, raw, update_fields, **kwargs):
+    # теги разбираются при создании и правке текста, а не при каждом save
+    if raw or (update_fields is not None and 'text' not in update_fields):
+        return
+    index_post(instance, created)
+
+
+@receiver(post_save, sender=Post)
+def update_image_derivatives(sender, instance, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    build_derivatives(instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_replaced_image(sender, instance, raw, update_fields, **kwargs):
+    if raw or instance._state.adding or (
+            update_fields is not None and 'image' not in update_fields):
+        return
+    old = sender._base_manager.using(kwargs['using']).filter(
+        pk=instance.pk).values_list('image', flat=True).first()
+    # новый файл получит имя только при сохранении, поэтому сравнивать
+    # с ним имена ещё рано
+    uploaded = instance.image and not instance.image._committed
+    if old and (uploaded or old != instance.image.name):
+        instance._replaced_image = old
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, using, **kwargs):
+    old = instance.__dict__.pop('_replaced_image', None)
+    if old:
+        transaction.on_commit(lambda: change_references([old], -1),
+                              using=using)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=ArchivedPost)
+@receiver(post_delete, sender=ImageDerivative)
+def release_media(sender, instance, using, **kwargs):
+    # срабатывает и при каскадном удалении копий для srcset
+    names = media_names([instance])
+    transaction.on_commit(lambda: change_references(names, -1), using=using)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def reset_cached_object(sender, instance, **kwargs):
+    object_cache = OBJECT_CACHES[sender]
+    object_cache.invalidate(instance)
+    # повторно после коммита, как и для пользователя запроса
+    transaction.on_commit(lambda: object_cache.invalidate(instance))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        add_followed_author(instance.user_id, instance.author_id)
+        invalidate_feed_counts(f'follow:{instance.user_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    # срабатывает и при отписке, и при каскадном удалении пользователя
+    remove_followed_author(instance.user_id, instance.author_id)
+    invalidate_feed_counts(f'follow:{instance.user_id}')
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    # id удалённого пользователя может достаться новому
+    if created:
+        reset_followed_authors(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    reset_followed_authors(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    # и ещё раз после коммита: соседний запрос мог до него прочитать из
+    # базы старую строку и положить её в кеш под новой версией
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def copy_to_shards(sender, instance, using, **kwargs):
+    replicate(instance, using)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def delete_from_shards(sender, instance, using, **kwargs):
+    replicate_delete(instance, using)
+
+
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def reset_flatpages(sender, **kwargs):
+    invalidate_flatpages()
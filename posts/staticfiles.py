@@ -0,0 +1,104 @@
+"""
+Статика для продакшена.
+
+collectstatic с CompressedManifestStaticFilesStorage:
+
+* склеивает наборы из STATIC_BUNDLES в один файл на набор: вместо трёх
+  запросов к bootstrap и jquery страница делает два, а исходники уже
+  минифицированы (*.min.*). Набор собирается, только если все его файлы
+  нашлись среди собранных;
+* добавляет в имена хеш содержимого (ManifestStaticFilesStorage), такие
+  файлы posts.serving кеширует навсегда;
+* рядом с текстовыми файлами кладёт сжатые копии .gz, и posts.serving
+  отдаёт их клиентам с gzip в Accept-Encoding без сжатия на лету.
+
+Тег {% bundle %} из posts/templatetags/assets.py подключает набор, а при
+DEBUG или без собранного набора — его исходные файлы.
+"""
+import gzip
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.map', '.txt',
+                         '.html', '.xml', '.ico', '.eot', '.ttf')
+# меньшие файлы почти не сжимаются, а заголовки всё равно дороже
+COMPRESS_MIN_SIZE = 256
+CSS_URL_RE = re.compile(
+    r'''url\((?P<quote>['"]?)(?!data:|[a-z]+://|/|#)(?P<url>[^'")]+)(?P=quote)\)''')
+
+
+def rebase_css_urls(content, source, target):
+    """Относительные url() из ``source`` переписываются относительно
+    ``target``, чтобы склеенный CSS ссылался на те же файлы."""
+    source_dir = posixpath.dirname(source)
+    target_dir = posixpath.dirname(target) or '.'
+
+    def rebase(match):
+        path = posixpath.normpath(posixpath.join(source_dir, match['url']))
+        return 'url(%s%s%s)' % (match['quote'],
+                                posixpath.relpath(path, target_dir),
+                                match['quote'])
+    return CSS_URL_RE.sub(rebase, content)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # файлов, которых нет в манифесте (тесты, статика до collectstatic),
+    # отдаются по исходному имени, а не роняют шаблон
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            paths.update(self.build_bundles(paths))
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name, hashed_name in self.hashed_files.items():
+            self.compress(name)
+            self.compress(hashed_name)
+
+    def build_bundles(self, paths):
+        bundles = {}
+        for bundle, sources in settings.STATIC_BUNDLES.items():
+            if not all(source in paths for source in sources):
+                continue
+            parts = []
+            for source in sources:
+                storage, path = paths[source]
+                with storage.open(path) as file:
+                    content = file.read().decode()
+                if bundle.endswith('.css'):
+                    content = rebase_css_urls(content, source, bundle)
+                parts.append(content)
+            # «;» отделяет скрипты, если в конце файла нет точки с запятой
+            separator = '\n;\n' if bundle.endswith('.js') else '\n'
+            if self.exists(bundle):
+                self.delete(bundle)
+            self._save(bundle, ContentFile(separator.join(parts).encode()))
+            bundles[bundle] = (self, bundle)
+        return bundles
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSED_EXTENSIONS) or not self.exists(name):
+            return
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < COMPRESS_MIN_SIZE:
+            return
+        # mtime=0: одинаковый файл даёт одинаковый архив при каждой сборке
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) >= len(content):
+            return
+        if self.exists(name + '.gz'):
+            self.delete(name + '.gz')
+        self._save(name + '.gz', ContentFile(compressed))
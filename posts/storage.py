@@ -0,0 +1,165 @@
+"""
+Хранилище изображений записей с адресацией по содержимому.
+
+Файл сохраняется под именем из sha256 содержимого, разложенным по двум
+уровням каталогов: ``posts/ab/cd/abcd…ef.jpg``. В одном каталоге
+оказывается лишь небольшая часть файлов, а одинаковые изображения,
+загруженные разными людьми, хранятся один раз. Хеш загрузки считается
+обработчиком HashingUploadHandler прямо во время приёма, остальные файлы
+хешируются при записи.
+
+Каждое сохранение увеличивает счётчик ссылок в таблице Blob. Удаление
+записи, архивной записи или копии для srcset и замена изображения
+уменьшают его после коммита (posts.signals), перенос в архив и в другой
+шард переносит ссылки вместе со строками. Сами файлы удаляет только
+команда collect_media: она заодно пересчитывает ссылки по записям,
+архиву и копиям во всех шардах, исправляя расхождения, и убирает файлы
+без ссылок, которые давно не использовались.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _default_file_mode():
+    # с такими правами FileSystemStorage создаёт файлы без
+    # FILE_UPLOAD_PERMISSIONS; umask можно узнать, только заменив его
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+DEFAULT_FILE_MODE = _default_file_mode()
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загрузку во временный файл и попутно считает её sha256."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+def blob_name(directory, digest, extension):
+    return os.path.join(directory, digest[:2], digest[2:4],
+                        digest + extension.lower())
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # имя всё равно заменяется хешем, проверять его занятость незачем
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1]
+        digest = getattr(content, 'sha256', None)
+        if hasattr(content, 'temporary_file_path'):
+            # файл уже на диске и остаётся за загрузкой: в хранилище
+            # появляется жёсткая ссылка на него, без копирования
+            source = content.temporary_file_path()
+            if digest is None:
+                digest = self._hash_file(source)
+            temporary = False
+        else:
+            source, digest = self._write_temporary(content)
+            temporary = True
+
+        name = blob_name(directory, digest, extension)
+        path = self.path(name)
+        if os.path.exists(path):
+            if temporary:
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if temporary:
+                # одинаковый файл мог только что записать соседний запрос,
+                # замена атомарна и содержимое то же
+                os.replace(source, path)
+            else:
+                self._link_or_copy(source, path)
+            # жёсткая ссылка и переименованный файл сохраняют права 0600
+            # временного файла, а отдавать его будет и веб-сервер
+            os.chmod(path, self.file_permissions_mode or DEFAULT_FILE_MODE)
+        self._add_reference(name, os.path.getsize(path))
+        return name
+
+    def delete(self, name):
+        """Уменьшает счётчик ссылок; файл удаляет команда collect_media."""
+        change_references([name], -1)
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _link_or_copy(self, source, path):
+        try:
+            os.link(source, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # временный файл на другой файловой системе
+            with open(source, 'rb') as file:
+                temporary, _ = self._write_temporary(File(file))
+            os.replace(temporary, path)
+
+    def _write_temporary(self, content):
+        """Копирует содержимое во временный файл рядом с хранилищем,
+        чтобы затем переименовать его без копирования, и считает хеш."""
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.location, prefix='.upload-',
+                                         delete=False) as file:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            except BaseException:
+                os.remove(file.name)
+                raise
+        return file.name, digest.hexdigest()
+
+    @staticmethod
+    def _add_reference(name, size):
+        from .models import Blob  # модели ссылаются на хранилище
+        Blob.objects.get_or_create(name=name, defaults={'size': size})
+        Blob.objects.filter(name=name).update(
+            refcount=F('refcount') + 1, last_used=timezone.now())
+
+
+def change_references(names, delta):
+    """Прибавляет ``delta`` к счётчику каждого файла из ``names`` столько
+    раз, сколько он там встречается. Счётчик не опускается ниже нуля."""
+    from .models import Blob
+    for name, count in Counter(filter(None, names)).items():
+        Blob.objects.filter(name=name).update(
+            refcount=Greatest(F('refcount') + delta * count, Value(0)))
+
+
+post_media_storage = ContentAddressedStorage()
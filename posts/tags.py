@@ -0,0 +1,48 @@
+"""
+Хештеги и упоминания. Текст записи разбирается один раз при сохранении,
+а найденные #теги и @имена складываются в таблицы PostTag и
+PostMention, по которым ленты тега и упоминаний читаются индексом, а не
+поиском LIKE по всем текстам. Строки ссылаются на горячие записи и
+удаляются при переносе записи в архив, так что обе ленты покрывают
+только записи, которые ещё не в архиве, см. posts.archive.
+"""
+from .markup import MENTION_RE, TAG_RE
+from .models import PostMention, PostTag, User
+
+TAG_MAX_LENGTH = PostTag._meta.get_field('name').max_length
+
+
+def extract_tags(text):
+    return {tag.lower()[:TAG_MAX_LENGTH] for tag in TAG_RE.findall(text)}
+
+
+def extract_mentions(text):
+    return set(MENTION_RE.findall(text))
+
+
+def index_post(post, created=False):
+    """
+    Приводит теги и упоминания записи в соответствие с её текстом,
+    добавляя и удаляя только изменившиеся строки. У новой записи строк
+    ещё нет, и их не нужно читать.
+    """
+    using = post._state.db
+    tags = extract_tags(post.text)
+    existing = set() if created else set(
+        post.tag_links.values_list('name', flat=True))
+    if existing - tags:
+        post.tag_links.filter(name__in=existing - tags).delete()
+    PostTag.objects.using(using).bulk_create(
+        [PostTag(post=post, name=name, pub_date=post.pub_date)
+         for name in tags - existing], ignore_conflicts=True)
+
+    names = extract_mentions(post.text)
+    users = set(User.objects.filter(username__in=names).exclude(
+        pk=post.author_id).values_list('pk', flat=True)) if names else set()
+    existing = set() if created else set(
+        post.mentions.values_list('user_id', flat=True))
+    if existing - users:
+        post.mentions.filter(user_id__in=existing - users).delete()
+    PostMention.objects.using(using).bulk_create(
+        [PostMention(post=post, user_id=user_id, pub_date=post.pub_date)
+         for user_id in users - existing], ignore_conflicts=True)
@@ -0,0 +1,60 @@
+"""
+Загрузчик шаблонов, который убирает из исходника HTML-комментарии и
+отступы до компиляции. Вместе с cached.Loader это делается один раз на
+процесс, а не на каждый ответ, и ленты не отдают килобайты пробелов из
+post_item.html, paginator.html и comments.html.
+
+Переводы строк сохраняются, поэтому пробелы между строчными элементами
+остаются на месте. Содержимое pre, textarea, script и style не
+трогается, как и комментарии с тегами шаблона внутри.
+"""
+import re
+
+from django.template.loaders.base import Loader as BaseLoader
+
+PRESERVE_RE = re.compile(r'<(pre|textarea|script|style)\b.*?</\1\s*>',
+                         re.S | re.I)
+# условные комментарии IE — это разметка, а не комментарии
+COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.S)
+INDENT_RE = re.compile(r'[ \t\r\f\v]*\n\s*')
+
+
+def _drop_comment(match):
+    return match.group() if '{%' in match.group() else ''
+
+
+def _collapse(html):
+    return INDENT_RE.sub('\n', COMMENT_RE.sub(_drop_comment, html))
+
+
+def minify_html(source):
+    parts = []
+    position = 0
+    for match in PRESERVE_RE.finditer(source):
+        parts.append(_collapse(source[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(_collapse(source[position:]))
+    return ''.join(parts)
+
+
+class Loader(BaseLoader):
+    """Оборачивает загрузчики ``loaders`` так же, как cached.Loader."""
+
+    def __init__(self, engine, loaders):
+        self.loaders = engine.get_template_loaders(loaders)
+        super().__init__(engine)
+
+    def get_template_sources(self, template_name):
+        for loader in self.loaders:
+            for origin in loader.get_template_sources(template_name):
+                # источник читает исходный загрузчик, а сжимает этот
+                origin.source_loader, origin.loader = origin.loader, self
+                yield origin
+
+    def get_contents(self, origin):
+        return minify_html(origin.source_loader.get_contents(origin))
+
+    def reset(self):
+        for loader in self.loaders:
+            loader.reset()
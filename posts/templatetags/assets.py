@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+TAGS = {
+    '.css': '<link rel="stylesheet" href="{}">',
+    '.js': '<script src="{}"></script>',
+}
+
+
+@register.simple_tag
+def bundle(name):
+    """
+    Подключает набор статики из STATIC_BUNDLES одним файлом. При DEBUG и
+    пока collectstatic не собрал набор подключаются его исходные файлы.
+    """
+    tag = TAGS[name[name.rindex('.'):]]
+    manifest = getattr(staticfiles_storage, 'hashed_files', {})
+    if settings.DEBUG or name not in manifest:
+        return format_html_join(
+            '\n', tag, ((staticfiles_storage.url(source),)
+                        for source in settings.STATIC_BUNDLES[name]))
+    return format_html(tag, staticfiles_storage.url(name))
@@ -0,0 +1,33 @@
+from django import template
+
+register = template.Library()
+
+# карточка занимает всю ширину колонки, но не шире 960px
+CARD_SIZES = '(max-width: 992px) 100vw, 960px'
+
+
+def srcset(derivatives):
+    return ', '.join(f'{item.file.url} {item.width}w' for item in derivatives)
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post):
+    """
+    Изображение карточки: srcset из готовых копий, см. posts.images.
+    У записей из архива и у записей, копии которых не построились,
+    остаётся миниатюра sorl.
+    """
+    derivatives = []
+    if post.image and hasattr(post, 'derivatives'):
+        # список подгружается prefetch_related('derivatives') ленты
+        derivatives = [item for item in post.derivatives.all()
+                       if item.source == post.image.name]
+    webp = [item for item in derivatives if item.format == 'WEBP']
+    fallback = [item for item in derivatives if item.format != 'WEBP']
+    return {
+        'post': post,
+        'image': fallback[-1] if fallback else None,
+        'srcset': srcset(fallback),
+        'webp_srcset': srcset(webp),
+        'sizes': CARD_SIZES,
+    }
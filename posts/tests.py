@@ -1,10 +1,49 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.contrib.sessions.models import Session
+from django.contrib.sites.models import Site
+from django.contrib.admin.sites import site as admin_site
 from django.core.cache import cache
-from django.test import TestCase, override_settings, Client
-from django.urls import reverse
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.db.models.signals import post_init
+from django.http import Http404, StreamingHttpResponse
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         Client, RequestFactory)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
 
-from posts.models import User, Post, Group, Follow, Comment
+from posts.archive import with_archive
+from posts.auth import CachedModelBackend, invalidate_user, user_cache_key
+from posts.caching import (FEED_COUNT_LOCK_KEY, followed_authors, group_stats,
+                           is_following)
+from posts.models import (User, Post, Group, Follow, Comment,
+                          FollowSuggestion, PostScore, Reaction,
+                          DeletionJob, ArchivedPost, ArchivedComment,
+                          AuthorShard, IdBlock, PostTag, PostMention, Blob)
+from posts.deletion import schedule_group_deletion, schedule_user_deletion
+from posts.middleware import CompressionMiddleware, compression_stats
+from posts.objcache import OBJECT_CACHES, post_cache, user_cache
+from posts.serving import serve
+from posts.storage import DEFAULT_FILE_MODE
+from posts.template_loaders import minify_html
+from posts.sharding import allocator, merge_slices, plan_moves, shard_for
+from posts.counters import (post_views, profile_views, reaction_counts,
+                            start_flush_timer, view_scores)
 from PIL import Image
+import gzip
+import json
+import os
+import shutil
 import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 
@@ -163,7 +202,7 @@ class PageCacheTest(TestCase):
         # Creating the page cache and checking that the new post has not yet appeared
         self.authorized_client.get(reverse('index'))
         self.authorized_client.post(reverse('new_post'), {'text': text})
-        response = self.client.get(reverse('index'))
+        response = self.authorized_client.get(reverse('index'))
         self.assertNotContains(response, text)
         cache.clear()
         response = self.client.get(reverse('index'))
@@ -172,6 +211,18 @@ class PageCacheTest(TestCase):
             'test_text',
             msg_prefix="The post didn't appear on the main page after clearing the cache")
 
+    def test_fragment_not_shared_between_users(self):
+        """ Reaction forms and CSRF tokens don't leak from a cached fragment """
+        Post.objects.create(text='text', author=self.user)
+        form = 'name="csrfmiddlewaretoken"'
+        self.assertNotContains(self.client.get(reverse('index')), form)
+        response = self.authorized_client.get(reverse('index'))
+        self.assertContains(response, form)
+        other = User.objects.create_user(username='other')
+        self.client.force_login(other)
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Редактировать')
+
 
 class TestFollowerSystem(TestCase):
     """Test subscriptions and unsubscriptions, and pages for subscribers"""
@@ -263,3 +314,1624 @@ class TestCommentSystem(TestCase):
             {'text': comment_text})
         comment_count = Comment.objects.count()
         self.assertEqual(comment_count, 0)
+
+
+class TestGroupIndex(TestCase):
+    """Group listing with aggregated stats"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.author = User.objects.create_user(username="another",
+                                               password=12345)
+        self.group = Group.objects.create(title='test_title', slug='test_slug',
+                                          description='test_description')
+        self.empty_group = Group.objects.create(title='empty', slug='empty',
+                                                description='empty')
+        Post.objects.create(text='first', author=self.user, group=self.group)
+        Post.objects.create(text='second', author=self.user, group=self.group)
+        Post.objects.create(text='third', author=self.author, group=self.group)
+
+    def get_stats(self):
+        response = self.client.get(reverse('group_stats_api'))
+        self.assertEqual(response.status_code, 200)
+        return {group['slug']: group for group in response.json()['groups']}
+
+    def test_group_stats(self):
+        stats = self.get_stats()
+        self.assertEqual(stats['test_slug']['post_count'], 3)
+        self.assertEqual(stats['test_slug']['author_count'], 2)
+        self.assertIsNotNone(stats['test_slug']['last_post'])
+        self.assertEqual(stats['empty']['post_count'], 0)
+        self.assertIsNone(stats['empty']['last_post'])
+
+        response = self.client.get(reverse('group_index'))
+        self.assertContains(response, 'test_title')
+        self.assertEqual(len(response.context['groups']), 2)
+
+    def test_group_stats_cached(self):
+        self.get_stats()
+        with self.assertNumQueries(0):
+            self.client.get(reverse('group_stats_api'))
+
+    def test_group_stats_invalidation(self):
+        self.get_stats()
+        post = Post.objects.create(text='moved', author=self.author,
+                                   group=self.group)
+        self.assertEqual(self.get_stats()['test_slug']['post_count'], 4)
+        post.group = self.empty_group
+        post.save()
+        stats = self.get_stats()
+        self.assertEqual(stats['test_slug']['post_count'], 3)
+        self.assertEqual(stats['empty']['post_count'], 1)
+        post.delete()
+        self.assertEqual(self.get_stats()['empty']['post_count'], 0)
+
+
+@contextmanager
+def count_loaded_posts():
+    """Counts Post instances built from the database inside the block"""
+    loaded = []
+
+    def on_init(sender, instance, **kwargs):
+        loaded.append(instance)
+
+    post_init.connect(on_init, sender=Post)
+    try:
+        yield loaded
+    finally:
+        post_init.disconnect(on_init, sender=Post)
+
+
+class TestFeedContexts(TestCase):
+    """Feed views render a single bounded page of posts"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.reader = User.objects.create_user(username="reader",
+                                               password=12345)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+        self.group = Group.objects.create(title='test_title', slug='test_slug',
+                                          description='test_description')
+        Follow.objects.create(user=self.reader, author=self.user)
+        for number in range(settings.POSTS_PER_PAGE * 2 + 5):
+            Post.objects.create(text=f'post {number}', author=self.user,
+                                group=self.group)
+
+    def test_feeds_load_one_page(self):
+        urls = [
+            reverse('index'),
+            reverse('group_post', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+            reverse('follow_index'),
+        ]
+        for url in urls:
+            with self.subTest(url=url), count_loaded_posts() as loaded:
+                response = self.authorized_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(loaded), settings.POSTS_PER_PAGE)
+
+    def test_feed_context_contract(self):
+        response = self.authorized_client.get(
+            reverse('group_post', args=[self.group.slug]))
+        self.assertNotIn('posts', response.context)
+        response = self.authorized_client.get(
+            reverse('profile', args=[self.user.username]))
+        self.assertNotIn('post_list', response.context)
+        self.assertEqual(len(response.context['page']),
+                         settings.POSTS_PER_PAGE)
+
+
+class TestFollowCache(TestCase):
+    """Cached followed-author sets"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.author = User.objects.create_user(username="author",
+                                               password=12345)
+        self.other = User.objects.create_user(username="other",
+                                              password=12345)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_followed_authors_sorted(self):
+        Follow.objects.create(user=self.user, author=self.other)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(followed_authors(self.user.id).tolist(),
+                         sorted([self.author.id, self.other.id]))
+        followed_authors(self.author.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_following(self.user.id, self.author.id))
+            self.assertFalse(is_following(self.author.id, self.user.id))
+
+    def test_follow_views_update_cache(self):
+        self.assertFalse(is_following(self.user.id, self.author.id))
+        self.authorized_client.get(
+            reverse('profile_follow', args=[self.author.username]))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_following(self.user.id, self.author.id))
+        self.authorized_client.get(
+            reverse('profile_unfollow', args=[self.author.username]))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_following(self.user.id, self.author.id))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unfollow_with_stale_cache(self):
+        followed_authors(self.user.id)
+        # строка появилась мимо сигналов, как из другого процесса
+        Follow.objects.bulk_create([Follow(user=self.user, author=self.author)])
+        self.authorized_client.get(
+            reverse('profile_unfollow', args=[self.author.username]))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_follow_feed_and_badge(self):
+        post = Post.objects.create(text='followed', author=self.author)
+        Post.objects.create(text='not followed', author=self.other)
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.author, author=self.user)
+        response = self.authorized_client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']), [post])
+        response = self.authorized_client.get(
+            reverse('profile', args=[self.author.username]))
+        self.assertTrue(response.context['following'])
+        self.assertTrue(response.context['follows_you'])
+        self.assertContains(response, 'Подписан на вас')
+
+    def test_deleted_author_dropped_from_cache(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertTrue(is_following(self.user.id, self.author.id))
+        author_id = self.author.id
+        self.author.delete()
+        self.assertFalse(is_following(self.user.id, author_id))
+
+
+class TestFollowSuggestions(TestCase):
+    """Offline who-to-follow suggestions"""
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.friend, self.star, self.peer = [
+            User.objects.create_user(username=name, password=12345)
+            for name in ('testuser', 'friend', 'star', 'peer')
+        ]
+        Follow.objects.create(user=self.user, author=self.friend)
+        Follow.objects.create(user=self.friend, author=self.star)
+        Follow.objects.create(user=self.peer, author=self.friend)
+        Follow.objects.create(user=self.peer, author=self.star)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_command_stores_suggestions(self):
+        call_command('compute_follow_suggestions', stdout=StringIO())
+        suggested = FollowSuggestion.objects.filter(user=self.user)
+        self.assertEqual([item.author for item in suggested], [self.star])
+        self.assertFalse(FollowSuggestion.objects.filter(
+            user=self.user, author=self.friend).exists())
+
+    def test_suggestions_served(self):
+        call_command('compute_follow_suggestions', stdout=StringIO())
+        response = self.authorized_client.get(reverse('follow_index'))
+        self.assertEqual(response.context['suggestions'], [self.star])
+        response = self.authorized_client.get(
+            reverse('profile', args=[self.friend.username]))
+        self.assertEqual(response.context['suggestions'], [self.star])
+        Follow.objects.create(user=self.user, author=self.star)
+        response = self.authorized_client.get(reverse('follow_index'))
+        self.assertEqual(response.context['suggestions'], [])
+
+
+class TestTrending(TestCase):
+    """Trending feed backed by PostScore"""
+
+    def setUp(self):
+        cache.clear()
+        view_scores.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.quiet = Post.objects.create(text='quiet', author=self.user)
+        self.busy = Post.objects.create(text='busy', author=self.user)
+
+    def comment(self, post):
+        self.authorized_client.post(
+            reverse('add_comment', args=[self.user.username, post.id]),
+            {'text': 'comment'})
+
+    def test_comments_and_views_raise_score(self):
+        self.comment(self.busy)
+        self.comment(self.busy)
+        self.authorized_client.get(
+            reverse('post', args=[self.user.username, self.quiet.id]))
+        view_scores.flush()
+        self.assertGreater(PostScore.objects.get(post=self.busy).score,
+                           PostScore.objects.get(post=self.quiet).score)
+        response = self.authorized_client.get(reverse('trending'))
+        self.assertEqual(list(response.context['page']),
+                         [self.busy, self.quiet])
+
+    def test_decay(self):
+        PostScore.objects.create(post=self.busy, score=4)
+        PostScore.objects.create(post=self.quiet, score=0.015)
+        call_command('decay_post_scores', hours=24, half_life=24,
+                     stdout=StringIO())
+        self.assertEqual(PostScore.objects.get(post=self.busy).score, 2)
+        self.assertFalse(PostScore.objects.filter(post=self.quiet).exists())
+
+
+class TestCommentPages(TestCase):
+    """Cursor-paginated comments on the post page"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.post = Post.objects.create(text='text', author=self.user)
+        self.total = settings.COMMENTS_PER_PAGE * 2 + 5
+        for number in range(self.total):
+            author = User.objects.create_user(username=f"commenter{number}")
+            Comment.objects.create(post=self.post, author=author,
+                                   text=f'comment {number}')
+        # одинаковое время создания проверяет разрешение по id
+        Comment.objects.filter(id__lte=10).update(
+            created=Comment.objects.get(id=10).created)
+
+    def test_post_page_is_bounded(self):
+        url = reverse('post', args=[self.user.username, self.post.id])
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['comments']),
+                         settings.COMMENTS_PER_PAGE)
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_cursor_walks_all_comments(self):
+        url = reverse('post_comments', args=[self.user.username, self.post.id])
+        seen = []
+        cursor = ''
+        # автор и запись попадают в кеш объектов, дальше страницы
+        # комментариев стоят два запроса
+        self.client.get(url)
+        while True:
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'cursor': cursor})
+            seen.extend(item.id for item in response.context['items'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        expected = list(Comment.objects.order_by('-created', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), self.total)
+
+
+@override_settings(COMMENTS_THREAD_DEPTH=2)
+class TestCommentThreads(TestCase):
+    """Threaded replies stored as materialised paths"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.post = Post.objects.create(text='text', author=self.user)
+
+    def reply(self, parent, text):
+        return Comment.objects.create(post=self.post, author=self.user,
+                                      text=text, parent=parent)
+
+    def test_reply_view_builds_path(self):
+        root = self.reply(None, 'root')
+        self.authorized_client.post(
+            reverse('add_comment', args=[self.user.username, self.post.id]),
+            {'text': 'answer', 'parent': root.id})
+        answer = Comment.objects.get(text='answer')
+        self.assertEqual(answer.parent, root)
+        self.assertEqual(answer.depth, 1)
+        self.assertTrue(answer.path.startswith(root.path))
+
+    def test_malformed_comment_ids(self):
+        response = self.authorized_client.post(
+            reverse('add_comment', args=[self.user.username, self.post.id]),
+            {'text': 'answer', 'parent': 'abc'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(
+            reverse('post_comments', args=[self.user.username, self.post.id]),
+            {'thread': 'abc'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_thread_loaded_in_tree_order(self):
+        root = self.reply(None, 'root')
+        first = self.reply(root, 'first')
+        second = self.reply(root, 'second')
+        nested = self.reply(first, 'nested')
+        deep = self.reply(nested, 'deep')
+        other = self.reply(None, 'other')
+        url = reverse('post', args=[self.user.username, self.post.id])
+        response = self.client.get(url)
+        roots = list(response.context['comments'])
+        self.assertEqual(roots, [other, root])
+        self.assertEqual(roots[1].thread, [first, nested, second])
+        self.assertEqual([item.indent for item in roots[1].thread], [1, 2, 1])
+        # ответ глубже COMMENTS_THREAD_DEPTH подгружается отдельно
+        self.assertTrue(roots[1].thread[1].has_more)
+        self.assertContains(response, f'?thread={nested.id}')
+        response = self.client.get(
+            reverse('post_comments', args=[self.user.username, self.post.id]),
+            {'thread': nested.id})
+        self.assertEqual(list(response.context['items']), [deep])
+
+    def test_subtree_query(self):
+        root = self.reply(None, 'root')
+        child = self.reply(root, 'child')
+        self.reply(None, 'other')
+        grandchild = self.reply(child, 'grandchild')
+        subtree = Comment.objects.filter(child.subtree_filter()).order_by('path')
+        self.assertEqual(list(subtree), [child, grandchild])
+
+    def test_max_depth(self):
+        comment = self.reply(None, 'root')
+        for number in range(Comment.MAX_DEPTH + 2):
+            comment = self.reply(comment, f'level {number}')
+        self.assertEqual(comment.depth, Comment.MAX_DEPTH)
+        self.assertLessEqual(len(comment.path),
+                             Comment._meta.get_field('path').max_length)
+
+
+class TestReactions(TestCase):
+    """Reactions with a buffered per-post counter"""
+
+    def setUp(self):
+        cache.clear()
+        reaction_counts.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.post = Post.objects.create(text='text', author=self.user)
+        self.url = reverse('toggle_reaction',
+                           args=[self.user.username, self.post.id])
+
+    def test_toggle_is_buffered(self):
+        self.authorized_client.post(self.url)
+        self.assertTrue(Reaction.objects.filter(user=self.user,
+                                                post=self.post).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reaction_count, 0)
+        self.assertEqual(reaction_counts.pending(self.post.id), 1)
+        reaction_counts.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reaction_count, 1)
+
+        self.authorized_client.post(self.url)
+        self.assertFalse(Reaction.objects.exists())
+        reaction_counts.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reaction_count, 0)
+
+    def test_get_not_allowed(self):
+        response = self.authorized_client.get(self.url)
+        self.assertEqual(response.status_code, 405)
+
+    @override_settings(COUNTER_FLUSH_SIZE=2)
+    def test_flush_by_size(self):
+        other = Post.objects.create(text='other', author=self.user)
+        buffer = type(reaction_counts)(Post, 'reaction_count')
+        buffer.add(self.post.id)
+        buffer.add(other.id)
+        self.assertEqual(buffer.pending(self.post.id), 0)
+        other.refresh_from_db()
+        self.assertEqual(other.reaction_count, 1)
+
+    def test_negative_total_clamped_at_zero(self):
+        reaction_counts.add(self.post.id, -1)
+        reaction_counts.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reaction_count, 0)
+
+    def test_failed_flush_keeps_deltas(self):
+        buffer = type(reaction_counts)(Post, 'reaction_count',
+                                       flush_interval=0)
+        with mock.patch.object(buffer, '_write', side_effect=DatabaseError):
+            buffer.add(self.post.id, 2)
+        self.assertEqual(buffer.pending(self.post.id), 2)
+        buffer.add(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.reaction_count, 3)
+
+    def test_flush_timer(self):
+        flushed = threading.Event()
+        with mock.patch('posts.counters.flush_all', flushed.set):
+            stop = start_flush_timer(interval=0.01)
+            self.assertTrue(flushed.wait(5))
+            stop.set()
+
+    def test_count_rendered_from_post_row(self):
+        Post.objects.filter(id=self.post.id).update(reaction_count=7)
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]))
+        self.assertContains(response, '&hearts; 7')
+
+
+class TestViewCounters(TestCase):
+    """Buffered post and profile view counters"""
+
+    def setUp(self):
+        cache.clear()
+        for buffer in (post_views, profile_views, view_scores):
+            buffer.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.posts = [Post.objects.create(text=f'post {number}',
+                                          author=self.user)
+                      for number in range(3)]
+
+    def test_views_flushed_in_one_statement(self):
+        for post in self.posts:
+            for _ in range(post.id):
+                self.client.get(
+                    reverse('post', args=[self.user.username, post.id]))
+        self.assertFalse(Post.objects.filter(view_count__gt=0).exists())
+        with self.assertNumQueries(3):
+            # SAVEPOINT, UPDATE ... CASE, RELEASE
+            self.assertEqual(post_views.flush(), len(self.posts))
+        for post in self.posts:
+            post.refresh_from_db()
+            self.assertEqual(post.view_count, post.id)
+        self.assertLess(post_views.write_amplification(), 1)
+
+    def test_profile_views(self):
+        for _ in range(3):
+            self.client.get(reverse('profile', args=[self.user.username]))
+        profile_views.flush()
+        self.assertEqual(self.user.profile_stats.views, 3)
+        self.client.get(reverse('profile', args=[self.user.username]))
+        profile_views.flush()
+        self.user.profile_stats.refresh_from_db()
+        self.assertEqual(self.user.profile_stats.views, 4)
+
+
+class TestBackgroundDeletion(TestCase):
+    """Soft delete followed by a chunked background deletion job"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.reader = User.objects.create_user(username="reader",
+                                               password=12345)
+        self.group = Group.objects.create(title='test_title', slug='test_slug',
+                                          description='test_description')
+        self.posts = [Post.objects.create(text=f'post {number}',
+                                          author=self.user, group=self.group)
+                      for number in range(5)]
+        self.reader_post = Post.objects.create(text='reader post',
+                                               author=self.reader,
+                                               group=self.group)
+        root = Comment.objects.create(post=self.reader_post, author=self.user,
+                                      text='comment')
+        Comment.objects.create(post=self.reader_post, author=self.reader,
+                               text='reply', parent=root)
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text='comment on deleted post')
+        Follow.objects.create(user=self.reader, author=self.user)
+        Reaction.objects.create(user=self.reader, post=self.posts[0])
+
+    def test_user_hidden_immediately(self):
+        schedule_user_deletion(self.user)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['page']), [self.reader_post])
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('post', args=[self.user.username, self.posts[0].id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_pending_deletion_kept_apart_from_is_active(self):
+        schedule_user_deletion(self.user)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        # администратор выключает и снова включает пользователя
+        self.user.is_active = False
+        self.user.save()
+        self.user.is_active = True
+        self.user.save()
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]))
+        self.assertEqual(response.status_code, 404)
+        [stats] = group_stats()
+        self.assertEqual((stats['post_count'], stats['author_count']), (1, 1))
+
+    def test_deleted_group_posts_hidden(self):
+        loose = Post.objects.create(text='no group', author=self.user)
+        self.assertEqual(group_stats()[0]['post_count'], 6)
+        schedule_group_deletion(self.group)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['page']), [loose])
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]))
+        self.assertEqual(list(response.context['page']), [loose])
+        self.assertEqual(group_stats(), [])
+
+    def test_user_deleted_in_chunks(self):
+        schedule_user_deletion(self.user)
+        out = StringIO()
+        call_command('run_deletion_jobs', chunk_size=2, stdout=out)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(list(Post.objects.all()), [self.reader_post])
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(Reaction.objects.exists())
+        job = DeletionJob.objects.get()
+        self.assertIsNotNone(job.finished)
+        self.assertGreater(job.processed, 5)
+        self.assertIn('готово', out.getvalue())
+
+    def test_group_deleted_in_chunks(self):
+        schedule_group_deletion(self.group)
+        response = self.client.get(reverse('group_post', args=[self.group.slug]))
+        self.assertEqual(response.status_code, 404)
+        call_command('run_deletion_jobs', chunk_size=2, stdout=StringIO())
+        self.assertFalse(Group.objects.exists())
+        self.assertEqual(Post.objects.count(), 6)
+        self.assertFalse(Post.objects.filter(group__isnull=False).exists())
+
+
+@override_settings(POSTS_PER_PAGE=2)
+class TestArchive(TestCase):
+    """Old posts move to the archive tables and stay reachable"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.posts = [Post.objects.create(text=f'post {number}',
+                                          author=self.user)
+                      for number in range(5)]
+        self.old = self.posts[:3]
+        for days, post in zip((402, 401, 400), self.old):
+            Post.objects.filter(pk=post.pk).update(
+                pub_date=timezone.now() - timedelta(days=days))
+        root = Comment.objects.create(post=self.old[0], author=self.user,
+                                      text='root')
+        Comment.objects.create(post=self.old[0], author=self.user,
+                               text='reply', parent=root)
+        Reaction.objects.create(user=self.user, post=self.old[0])
+
+    def archive(self):
+        call_command('archive_posts', days=365, chunk_size=2, stdout=StringIO())
+
+    def test_old_posts_moved(self):
+        self.archive()
+        self.assertEqual(set(Post.objects.all()), set(self.posts[3:]))
+        self.assertEqual(
+            set(ArchivedPost.objects.values_list('id', flat=True)),
+            {post.id for post in self.old})
+        self.assertEqual(ArchivedComment.objects.count(), 2)
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Reaction.objects.exists())
+
+    def test_tag_feed_covers_hot_posts_only(self):
+        for post in (self.old[0], self.posts[3]):
+            post.refresh_from_db()
+            post.text = 'about #yatube'
+            post.save()
+        self.archive()
+        response = self.client.get(reverse('tag_posts', args=['yatube']))
+        self.assertEqual(list(response.context['posts']), [self.posts[3]])
+        self.assertEqual(PostTag.objects.count(), 1)
+
+    def test_permalink_reads_archive(self):
+        self.archive()
+        response = self.client.get(
+            reverse('post', args=[self.user.username, self.old[0].id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['post'].is_archived)
+        root = response.context['comments'][0]
+        self.assertEqual([reply.text for reply in root.thread], ['reply'])
+        self.assertNotContains(response, 'name="parent"')
+        response = self.client.post(
+            reverse('add_comment', args=[self.user.username, self.old[0].id]),
+            {'text': 'late'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_pages_continue_into_archive(self):
+        self.archive()
+        pages = []
+        for number in (1, 2, 3):
+            response = self.client.get(reverse('index'), {'page': number})
+            pages.append([post.id for post in response.context['page']])
+        self.assertEqual(response.context['paginator'].count, 5)
+        self.assertEqual(sum(pages, []), [post.id for post in self.posts[::-1]])
+
+    def test_first_page_skips_archive(self):
+        self.archive()
+        feed = with_archive(Post.objects.all())
+        # a full page of hot rows needs neither their count nor the archive
+        with self.assertNumQueries(1):
+            self.assertEqual(len(feed[0:2]), 2)
+
+
+@override_settings(POST_SHARDS=['default'], POSTS_PER_PAGE=2)
+class TestSharding(TestCase):
+    """Post sharding code paths, run against a single shard"""
+
+    def setUp(self):
+        cache.clear()
+        allocator.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.other = User.objects.create_user(username="other",
+                                              password=12345)
+        self.client.force_login(self.user)
+
+    def test_ids_come_from_shared_blocks(self):
+        first = Post.objects.create(text='first', author=self.user)
+        second = Post.objects.create(text='second', author=self.other)
+        comment = Comment.objects.create(post=first, author=self.other,
+                                         text='comment')
+        self.assertEqual(second.id, first.id + 1)
+        self.assertEqual(comment.path, f'{comment.id:06d}')
+        self.assertEqual(set(IdBlock.objects.values_list('name', flat=True)),
+                         {'posts.post', 'posts.comment'})
+
+    def test_authors_mapped_to_shard(self):
+        Post.objects.create(text='post', author=self.user)
+        self.assertEqual(shard_for(self.user.id), 'default')
+        self.assertTrue(AuthorShard.objects.filter(author=self.user).exists())
+
+    def test_feeds_gathered_from_shards(self):
+        posts = [Post.objects.create(text=f'post {number}',
+                                     author=[self.user, self.other][number % 2])
+                 for number in range(5)]
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertEqual(response.context['paginator'].count, 5)
+        self.assertEqual(list(response.context['page']), posts[2:0:-1])
+        response = self.client.get(
+            reverse('post', args=[self.user.username, posts[0].id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_merge_slices(self):
+        parts = [[9, 6, 2], [8, 7, 1], []]
+        self.assertEqual(merge_slices(parts, 2, 5, key=None), [7, 6, 2])
+
+    def test_plan_moves(self):
+        loads = {1: ('a', 8), 2: ('a', 6), 3: ('a', 4), 4: ('old', 2)}
+        moves = plan_moves(loads, ['a', 'b'], tolerance=0.2)
+        self.assertEqual(moves[0], (4, 'old', 'b'))
+        totals = {'a': 0, 'b': 0}
+        placement = {author: shard for author, (shard, _) in loads.items()}
+        for author, _, target in moves:
+            placement[author] = target
+        for author, shard in placement.items():
+            totals[shard] += loads[author][1]
+        self.assertEqual(totals, {'a': 10, 'b': 10})
+
+
+SHARD_ALIASES = ['shard_a', 'shard_b']
+
+
+@override_settings(POST_SHARDS=SHARD_ALIASES, POSTS_PER_PAGE=2)
+class TestMultipleShards(TransactionTestCase):
+    """Posts spread over two sqlite files and read back in parallel"""
+
+    databases = {'default', *SHARD_ALIASES}
+
+    @classmethod
+    def setUpClass(cls):
+        # пул потоков ходит в базы своими соединениями, поэтому шарды —
+        # файлы, а тест не оборачивается в транзакцию
+        cls.directory = tempfile.mkdtemp()
+        for alias in SHARD_ALIASES:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.directory, f'{alias}.sqlite3'),
+            }
+            call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in SHARD_ALIASES:
+            connections[alias].close()
+            del connections.databases[alias]
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        cache.clear()
+        allocator.clear()
+        self.users = [User.objects.create_user(username=f'author{number}')
+                      for number in range(2)]
+
+    def test_create_routed_by_author(self):
+        posts = [Post.objects.create(text='post', author=user)
+                 for user in self.users]
+        for user, post in zip(self.users, posts):
+            alias = shard_for(user.id)
+            self.assertEqual(post._state.db, alias)
+            self.assertTrue(Post.objects.using(alias).filter(
+                pk=post.pk).exists())
+        self.assertEqual(
+            {post._state.db for post in posts}, set(SHARD_ALIASES))
+        self.assertFalse(Post.objects.using('default').exists())
+        comment = Comment.objects.create(post=posts[0], author=self.users[1],
+                                         text='comment')
+        self.assertTrue(Comment.objects.using(posts[0]._state.db).filter(
+            pk=comment.pk).exists())
+
+    def test_feed_gathered_from_shards(self):
+        posts = [Post.objects.create(text=f'post {number}',
+                                     author=self.users[number % 2])
+                 for number in range(5)]
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertEqual(response.context['paginator'].count, 5)
+        self.assertEqual([post.id for post in response.context['page']],
+                         [posts[2].id, posts[1].id])
+        response = self.client.get(
+            reverse('post', args=[self.users[1].username, posts[1].id]))
+        self.assertContains(response, 'post 1')
+
+    def test_follow_feed_with_many_follows(self):
+        reader = User.objects.create_user(username='reader')
+        User.objects.bulk_create(
+            [User(username=f'other{number}') for number in range(505)])
+        Follow.objects.bulk_create(
+            [Follow(user=reader, author=author)
+             for author in User.objects.exclude(pk=reader.pk)])
+        posts = [Post.objects.create(text='followed', author=user)
+                 for user in self.users]
+        self.client.force_login(reader)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['paginator'].count, 2)
+        self.assertEqual([post.id for post in response.context['page']],
+                         [posts[1].id, posts[0].id])
+
+
+@override_settings(POSTS_PER_PAGE=2)
+class TestTagsAndMentions(TestCase):
+    """Hashtags and @mentions are indexed on save and served by keyset feeds"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.reader = User.objects.create_user(username="reader",
+                                               password=12345)
+        self.client.force_login(self.user)
+
+    def test_new_post_indexed(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'Hello #Django #django #тест @reader @nobody'})
+        post = Post.objects.get()
+        self.assertEqual(set(post.tag_links.values_list('name', flat=True)),
+                         {'django', 'тест'})
+        self.assertEqual(list(post.mentions.values_list('user', flat=True)),
+                         [self.reader.id])
+
+    def test_edit_updates_incrementally(self):
+        post = Post.objects.create(text='#one #two @reader', author=self.user)
+        kept = post.tag_links.get(name='one')
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.id]),
+            {'text': '#one #three'})
+        self.assertEqual(set(post.tag_links.values_list('name', flat=True)),
+                         {'one', 'three'})
+        self.assertTrue(PostTag.objects.filter(pk=kept.pk).exists())
+        self.assertFalse(PostMention.objects.exists())
+
+    def test_tag_feed_keyset_pages(self):
+        posts = [Post.objects.create(text=f'post {number} #feed',
+                                     author=self.user) for number in range(5)]
+        Post.objects.create(text='other #tag', author=self.user)
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(reverse('tag_posts', args=['Feed']),
+                                       {'cursor': cursor} if cursor else {})
+            seen += response.context['posts']
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, posts[::-1])
+
+    def test_mentions_feed(self):
+        Post.objects.create(text='hi @testuser', author=self.reader)
+        Post.objects.create(text='no mention', author=self.reader)
+        response = self.client.get(reverse('mentions'))
+        self.assertEqual([post.text for post in response.context['posts']],
+                         ['hi @testuser'])
+
+
+class TestPostMarkup(TestCase):
+    """Post body HTML is rendered once on save"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+
+    def test_rendered_on_save(self):
+        post = Post.objects.create(
+            text='<b>hi</b> #Tag @testuser\nhttps://example.com/a?b=1.',
+            author=self.user)
+        self.assertEqual(
+            post.text_html,
+            '&lt;b&gt;hi&lt;/b&gt; <a href="/tag/tag/">#Tag</a> '
+            '<a href="/testuser/">@testuser</a><br>'
+            '<a href="https://example.com/a?b=1" rel="nofollow">'
+            'https://example.com/a?b=1</a>.')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<a href="/tag/tag/">#Tag</a>', html=True)
+
+    def test_rerendered_on_edit(self):
+        post = Post.objects.create(text='old', author=self.user)
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.id]),
+            {'text': 'new #text'})
+        post.refresh_from_db()
+        self.assertIn('/tag/text/', post.text_html)
+
+    def test_update_fields_without_text(self):
+        post = Post.objects.create(text='text', author=self.user)
+        Post.objects.filter(pk=post.pk).update(text_html='cached')
+        post.refresh_from_db()
+        post.save(update_fields=['group'])
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'cached')
+        post.text = 'changed'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'changed')
+
+
+@override_settings(POST_IMAGE_MAX_SIZE=100)
+class TestImageUpload(TestCase):
+    """Uploaded images are verified, downscaled and stripped of EXIF"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+
+    def upload(self, image, name, **options):
+        content = BytesIO()
+        image.save(content, **options)
+        upload = SimpleUploadedFile(name, content.getvalue())
+        with self.settings(MEDIA_ROOT=self.media):
+            self.client.post(reverse('new_post'),
+                             {'text': 'photo', 'image': upload})
+        return Post.objects.get()
+
+    def test_large_photo_downscaled_without_exif(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Phone'
+        post = self.upload(Image.new('RGB', (400, 200), 'red'), 'photo.jpeg',
+                           format='JPEG', exif=exif.tobytes())
+        self.assertEqual((post.image_width, post.image_height,
+                          post.image_format), (100, 50, 'JPEG'))
+        with Image.open(os.path.join(self.media, post.image.name)) as stored:
+            self.assertEqual(stored.size, (100, 50))
+            self.assertNotIn('exif', stored.info)
+
+    def test_small_image_kept(self):
+        post = self.upload(Image.new('RGBA', (60, 30)), 'small.png',
+                           format='PNG')
+        self.assertEqual((post.image_width, post.image_height,
+                          post.image_format), (60, 30, 'PNG'))
+        self.assertTrue(post.image.name.endswith('.png'))
+
+    def test_other_formats_stored_as_png(self):
+        post = self.upload(Image.new('RGB', (20, 10)), 'scan.bmp', format='BMP')
+        self.assertEqual(post.image_format, 'PNG')
+        self.assertTrue(post.image.name.endswith('.png'))
+
+    def test_backfill_posts_and_archive(self):
+        post = self.upload(Image.new('RGB', (60, 30)), 'old.png', format='PNG')
+        Post.objects.update(image_width=None, image_height=None,
+                            image_format='')
+        ArchivedPost.objects.create(id=post.id + 1, text='old',
+                                    pub_date=post.pub_date, author=self.user,
+                                    image=post.image.name)
+        with self.settings(MEDIA_ROOT=self.media):
+            call_command('backfill_image_info', stdout=StringIO())
+        for model in (Post, ArchivedPost):
+            row = model.objects.get()
+            self.assertEqual((row.image_width, row.image_height,
+                              row.image_format), (60, 30, 'PNG'))
+
+
+@override_settings(POST_IMAGE_WIDTHS=(40, 80))
+class TestImageDerivatives(TestCase):
+    """Cards get resized WebP and fallback copies in srcset"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.override = self.settings(MEDIA_ROOT=self.media)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def upload(self, image, name, format):
+        content = BytesIO()
+        image.save(content, format=format)
+        self.client.post(reverse('new_post'), {
+            'text': 'photo',
+            'image': SimpleUploadedFile(name, content.getvalue())})
+        return Post.objects.get()
+
+    def test_derivatives_built_once(self):
+        post = self.upload(Image.new('RGB', (200, 100), 'red'), 'a.jpg', 'JPEG')
+        self.assertEqual(
+            set(post.derivatives.values_list('format', 'width', 'height')),
+            {('WEBP', 40, 14), ('JPEG', 40, 14),
+             ('WEBP', 80, 28), ('JPEG', 80, 28)})
+        for item in post.derivatives.all():
+            self.assertTrue(os.path.exists(item.file.path))
+        post.save()
+        self.assertEqual(post.derivatives.count(), 4)
+
+    def test_narrow_image_not_upscaled(self):
+        post = self.upload(Image.new('RGBA', (60, 60)), 'a.png', 'PNG')
+        self.assertEqual(
+            set(post.derivatives.values_list('format', 'width')),
+            {('WEBP', 40), ('PNG', 40)})
+
+    def test_card_has_srcset(self):
+        self.upload(Image.new('RGB', (200, 100), 'red'), 'a.jpg', 'JPEG')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="80" height="28"')
+        self.assertContains(response, '.jpg 40w')
+
+    def test_missing_file_ignored(self):
+        post = Post.objects.create(text='text', author=self.user,
+                                   image='posts/missing.jpg')
+        self.assertFalse(post.derivatives.exists())
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_report(self):
+        self.upload(Image.new('RGB', (200, 100), 'red'), 'a.jpg', 'JPEG')
+        out = StringIO()
+        call_command('build_image_derivatives', stdout=out)
+        self.assertIn('Построено: 0', out.getvalue())
+        self.assertIn('    80', out.getvalue())
+
+
+@override_settings(POST_IMAGE_WIDTHS=(40,))
+class TestMediaStorage(TestCase):
+    """Uploads are stored by content hash, deduplicated and collected"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.override = self.settings(MEDIA_ROOT=self.media)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def upload(self, name, color='red'):
+        content = BytesIO()
+        Image.new('RGB', (60, 30), color).save(content, format='PNG')
+        self.client.post(reverse('new_post'), {
+            'text': 'photo',
+            'image': SimpleUploadedFile(name, content.getvalue())})
+        return Post.objects.latest('id')
+
+    def test_same_image_stored_once(self):
+        first = self.upload('a.png')
+        second = self.upload('b.PNG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name,
+                         r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.png$')
+        self.assertEqual(Blob.objects.get(name=first.image.name).refcount, 2)
+        self.assertTrue(os.path.exists(first.image.path))
+
+    def test_files_readable_by_web_server(self):
+        post = self.upload('a.png')
+        self.assertEqual(os.stat(post.image.path).st_mode & 0o777, 0o644)
+        with self.settings(FILE_UPLOAD_PERMISSIONS=None):
+            post = self.upload('b.png', color='blue')
+        for stored in [post.image.path] + [
+                item.file.path for item in post.derivatives.all()]:
+            self.assertEqual(os.stat(stored).st_mode & 0o777,
+                             DEFAULT_FILE_MODE)
+
+    def test_unreferenced_files_collected(self):
+        kept = self.upload('a.png')
+        dropped = self.upload('b.png', color='blue')
+        dropped_files = [dropped.image.path] + [
+            item.file.path for item in dropped.derivatives.all()]
+        dropped.delete()
+        out = StringIO()
+        call_command('collect_media', '--dry-run', '--grace-hours=0',
+                     stdout=out)
+        self.assertIn('Будет удалено файлов: 3', out.getvalue())
+        self.assertTrue(all(map(os.path.exists, dropped_files)))
+
+        call_command('collect_media', '--grace-hours=0', stdout=StringIO())
+        self.assertFalse(any(map(os.path.exists, dropped_files)))
+        self.assertTrue(os.path.exists(kept.image.path))
+        self.assertEqual(Blob.objects.get(name=kept.image.name).refcount, 1)
+        self.assertEqual(Blob.objects.count(), 3)
+
+    def test_recent_files_kept(self):
+        post = self.upload('a.png')
+        path = post.image.path
+        post.delete()
+        call_command('collect_media', stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+
+class TestMediaRefcounts(TransactionTestCase):
+    """Blob refcounts follow deletes, replaced images and the archive"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.override = self.settings(MEDIA_ROOT=self.media)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def image(self, name, color='red'):
+        content = BytesIO()
+        Image.new('RGB', (60, 30), color).save(content, format='PNG')
+        return SimpleUploadedFile(name, content.getvalue())
+
+    def refcounts(self):
+        return dict(Blob.objects.values_list('name', 'refcount'))
+
+    def test_delete_releases_files(self):
+        self.client.post(reverse('new_post'), {
+            'text': 'photo', 'image': self.image('a.png')})
+        post = Post.objects.get()
+        self.assertEqual(set(self.refcounts().values()), {1})
+        post.delete()
+        self.assertEqual(set(self.refcounts().values()), {0})
+
+    def test_replaced_image_released(self):
+        self.client.post(reverse('new_post'), {
+            'text': 'photo', 'image': self.image('a.png')})
+        post = Post.objects.get()
+        old = post.image.name
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.id]),
+            {'text': 'photo', 'image': self.image('b.png', color='blue')})
+        post.refresh_from_db()
+        refcounts = self.refcounts()
+        self.assertEqual(refcounts[old], 0)
+        self.assertEqual(refcounts[post.image.name], 1)
+        # копии прежнего изображения тоже отпущены
+        self.assertEqual(sum(refcounts.values()),
+                         1 + post.derivatives.count())
+
+    def test_archive_keeps_image(self):
+        self.client.post(reverse('new_post'), {
+            'text': 'photo', 'image': self.image('a.png')})
+        post = Post.objects.get()
+        Post.objects.filter(pk=post.pk).update(
+            pub_date=timezone.now() - timedelta(days=400))
+        call_command('archive_posts', days=365, stdout=StringIO())
+        refcounts = self.refcounts()
+        self.assertEqual(refcounts.pop(post.image.name), 1)
+        self.assertEqual(set(refcounts.values()), {0})
+
+
+class TestFileServing(TestCase):
+    """Media files support ranges, revalidation and long caching"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.name = 'a' * 64 + '.txt'
+        with open(os.path.join(self.root, self.name), 'wb') as file:
+            file.write(b'0123456789')
+        with open(os.path.join(self.root, 'plain.txt'), 'wb') as file:
+            file.write(b'plain')
+        self.factory = RequestFactory()
+
+    def get(self, path, **headers):
+        return serve(self.factory.get('/media/' + path, **headers), path,
+                     document_root=self.root, accel_location='/internal/media/')
+
+    def test_full_file(self):
+        response = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertNotIn('immutable', self.get('plain.txt')['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.get(self.name)['ETag']
+        response = self.get(self.name, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        response = self.get(self.name, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.get(self.name, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_stale_if_range_gets_full_file(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=2-4',
+                            HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_outside_root(self):
+        with self.assertRaises(Http404):
+            self.get('../outside.txt')
+        with self.assertRaises(Http404):
+            self.get('missing.txt')
+
+    @override_settings(SENDFILE_BACKEND='x-accel')
+    def test_accel_redirect(self):
+        response = self.get(self.name)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/internal/media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+
+class TestStaticPipeline(TestCase):
+    """collectstatic bundles, fingerprints and precompresses assets"""
+
+    def setUp(self):
+        self.assets = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.assets)
+        self.addCleanup(shutil.rmtree, self.root)
+        files = {
+            'bootstrap/dist/css/bootstrap.min.css':
+                '.a{background:url(../img/a.png)}' * 20,
+            'bootstrap/dist/img/a.png': 'png',
+            'jquery/dist/jquery.min.js': 'var jquery=1' * 50,
+            'bootstrap/dist/js/bootstrap.min.js': 'var bootstrap=1' * 50,
+        }
+        for name, content in files.items():
+            path = os.path.join(self.assets, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(content)
+        override = self.settings(STATICFILES_DIRS=[self.assets],
+                                 STATIC_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_collectstatic(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.root, 'staticfiles.json')) as file:
+            manifest = json.load(file)['paths']
+        css = manifest['bundle/site.css']
+        self.assertRegex(css, r'^bundle/site\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, css)) as file:
+            self.assertIn(manifest['bootstrap/dist/img/a.png'].replace(
+                'bootstrap/dist/', '../bootstrap/dist/'), file.read())
+        with gzip.open(os.path.join(
+                self.root, manifest['bundle/site.js'] + '.gz')) as file:
+            self.assertEqual(file.read().count(b'var'), 100)
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '/static/' + css, count=1)
+        self.assertNotContains(response, 'jquery.min.js')
+
+    def test_sources_without_bundle(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'bootstrap/dist/css/bootstrap.min.css')
+        self.assertContains(response, 'jquery/dist/jquery.min.js')
+
+    def test_precompressed_variant_served(self):
+        with open(os.path.join(self.root, 'a.css'), 'wb') as file:
+            file.write(b'body{}' * 100)
+        with open(os.path.join(self.root, 'a.css.gz'), 'wb') as file:
+            file.write(gzip.compress(b'body{}' * 100))
+        request = RequestFactory().get('/static/a.css',
+                                       HTTP_ACCEPT_ENCODING='gzip, br')
+        response = serve(request, 'a.css', document_root=self.root)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response = serve(RequestFactory().get('/static/a.css'), 'a.css',
+                         document_root=self.root)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Length'], '600')
+
+    def test_precompressed_hashed_name_immutable(self):
+        name = 'site.0123456789ab.css'
+        with open(os.path.join(self.root, name), 'wb') as file:
+            file.write(b'body{}')
+        with open(os.path.join(self.root, name + '.gz'), 'wb') as file:
+            file.write(gzip.compress(b'body{}'))
+        request = RequestFactory().get(f'/static/{name}',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        response = serve(request, name, document_root=self.root)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+class TestCompression(TestCase):
+    """Templates are minified once and large text responses are gzipped"""
+
+    def setUp(self):
+        cache.clear()
+        compression_stats.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+
+    def test_minify_html(self):
+        source = ('<div>\n    <!-- note -->\n    <p>a</p>  \n\n    <b>b</b>\n'
+                  '    <!-- {% if x %} -->\n'
+                  '<textarea>\n  keep\n</textarea></div>')
+        self.assertEqual(minify_html(source),
+                         '<div>\n<p>a</p>\n<b>b</b>\n<!-- {% if x %} -->\n'
+                         '<textarea>\n  keep\n</textarea></div>')
+
+    def test_feed_minified_and_compressed(self):
+        for number in range(10):
+            Post.objects.create(text=f'post {number}', author=self.user)
+        response = self.client.get(reverse('index'))
+        self.assertNotIn(b'<!--', response.content)
+        self.assertNotIn(b'\n    ', response.content)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = self.client.get(reverse('index'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'post 9', gzip.decompress(response.content))
+        stats = compression_stats['index']
+        self.assertEqual(stats['responses'], 2)
+        self.assertLess(stats['sent'], stats['original'])
+
+    @override_settings(GZIP_MIN_LENGTH=10 ** 6)
+    def test_small_response_not_compressed(self):
+        response = self.client.get(reverse('index'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_response(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = StreamingHttpResponse(
+            (b'line %d\n' % number for number in range(1000)),
+            content_type='text/plain')
+        response = CompressionMiddleware(lambda request: response)(request)
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body.count(b'line'), 1000)
+        stats = compression_stats['/']
+        self.assertEqual(stats['original'], len(body))
+        self.assertLess(stats['sent'], stats['original'])
+
+
+class TestIdentityCaching(TestCase):
+    """Sessions and the request user come from the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser",
+                                             password=12345)
+        self.client.force_login(self.user)
+
+    def test_no_identity_queries_when_cached(self):
+        self.client.get(reverse('mentions'))
+        session_key = self.client.session.session_key
+        with self.assertNumQueries(0):
+            SessionStore(session_key).load()
+            user = CachedModelBackend().get_user(self.user.pk)
+        self.assertEqual(user, self.user)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.client.get(reverse('mentions'))
+        self.user.set_password('changed')
+        self.user.save()
+        cached = CachedModelBackend().get_user(self.user.pk)
+        self.assertTrue(cached.check_password('changed'))
+        response = self.client.get(reverse('mentions'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_evicted_version_does_not_revive_old_copy(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        stale_key = user_cache_key(self.user.pk)
+        invalidate_user(self.user.pk)
+        cache.delete(f'auth_user_version:{self.user.pk}')
+        self.assertNotEqual(user_cache_key(self.user.pk), stale_key)
+
+    def test_clearsessions_in_chunks(self):
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key=f'old{number}', session_data='',
+                    expire_date=now - timedelta(days=1))
+            for number in range(5)])
+        out = StringIO()
+        call_command('clearsessions', chunk_size=2, stdout=out)
+        self.assertIn('Удалено сессий: 5', out.getvalue())
+        self.assertEqual(Session.objects.filter(expire_date__lt=now).count(), 0)
+        self.assertTrue(Session.objects.exists())
+
+
+class TestCachedFlatpages(TestCase):
+    """Flatpages are served from memory with ETags"""
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.get_current()
+        self.page = FlatPage.objects.create(url='/about-us/', title='About',
+                                            content='<p>first</p>')
+        self.page.sites.add(self.site)
+
+    def test_anonymous_page_rendered_once(self):
+        self.assertContains(self.client.get(reverse('about')), 'first')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('about'))
+        self.assertContains(response, 'first')
+        etag = response['ETag']
+        response = self.client.get(reverse('about'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_save_invalidates(self):
+        self.client.get(reverse('about'))
+        self.page.content = '<p>second</p>'
+        self.page.save()
+        self.assertContains(self.client.get(reverse('about')), 'second')
+
+    @override_settings(FLATPAGES_LOCAL_TIMEOUT=0)
+    def test_update_without_signals_expires(self):
+        self.client.get(reverse('about'))
+        FlatPage.objects.filter(pk=self.page.pk).update(
+            content='<p>second</p>')
+        self.assertContains(self.client.get(reverse('about')), 'second')
+
+    def test_authenticated_sees_own_name(self):
+        self.client.get(reverse('about'))
+        user = User.objects.create_user(username='reader', password=12345)
+        self.client.force_login(user)
+        self.assertContains(self.client.get(reverse('about')), 'reader')
+
+    def test_missing_page(self):
+        self.assertEqual(self.client.get('/about/missing/').status_code, 404)
+
+    def test_export(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        call_command('export_flatpages', output, stdout=StringIO())
+        with open(os.path.join(output, 'about-us', 'index.html')) as file:
+            self.assertIn('<p>first</p>', file.read())
+
+
+class TestObjectCache(TestCase):
+    """Post, author and group lookups go through the object cache"""
+
+    def setUp(self):
+        cache.clear()
+        for object_cache in OBJECT_CACHES.values():
+            object_cache.clear_local()
+        self.user = User.objects.create_user(username='author',
+                                             password=12345)
+        self.post = Post.objects.create(text='cached text', author=self.user)
+        self.url = reverse('post', args=['author', self.post.id])
+
+    def test_lookup_is_cached(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'cached text')
+        self.assertFalse([query for query in queries
+                          if '"posts_post"."id" = ' in query['sql']
+                          or '"auth_user"."username" = ' in query['sql']])
+
+    def test_shared_tier_survives_local_clear(self):
+        post_cache.get(self.post.id)
+        post_cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(post_cache.get(self.post.id), self.post)
+
+    def test_save_invalidates(self):
+        self.client.get(self.url)
+        self.post.text = 'edited text'
+        self.post.save()
+        self.assertContains(self.client.get(self.url), 'edited text')
+
+    def test_rename_invalidates(self):
+        self.client.get(self.url)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        url = reverse('post', args=['renamed', self.post.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_inactive_author(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_missing_is_cached(self):
+        self.assertIsNone(user_cache.get_by('nobody'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(user_cache.get_by('nobody'))
+        User.objects.create_user(username='nobody')
+        self.assertIsNotNone(user_cache.get_by('nobody'))
+
+    def test_hit_rate(self):
+        post_cache.stats.clear()
+        post_cache.get(self.post.id)
+        post_cache.get(self.post.id)
+        self.assertEqual(post_cache.stats['miss'], 1)
+        self.assertEqual(post_cache.stats['local'], 1)
+        self.assertEqual(post_cache.hit_rate(), 0.5)
+
+    def test_edit_keeps_flushed_counters(self):
+        self.client.get(self.url)
+        Post.objects.filter(id=self.post.id).update(view_count=6,
+                                                    reaction_count=3)
+        self.client.force_login(self.user)
+        self.client.post(reverse('post_edit', args=['author', self.post.id]),
+                         {'text': 'edited text'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text, 'edited text')
+        self.assertEqual((self.post.view_count, self.post.reaction_count),
+                         (6, 3))
+
+
+@override_settings(POSTS_PER_PAGE=2, PAGINATOR_WINDOW=1)
+class TestFeedCounts(TestCase):
+    """Feed paginators reuse cached counts"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author',
+                                             password=12345)
+        for number in range(9):
+            Post.objects.create(text=f'post {number}', author=self.user)
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query for query in queries
+                          if 'COUNT(*)' in query['sql']
+                          and '"posts_post"' in query['sql']]
+
+    def test_count_is_cached(self):
+        response, counts = self.count_queries(reverse('index'))
+        self.assertTrue(counts)
+        self.assertEqual(response.context['paginator'].count, 9)
+        response, counts = self.count_queries(reverse('index'), page=3)
+        self.assertFalse(counts)
+        self.assertEqual(response.context['paginator'].num_pages, 5)
+
+    def test_new_post_is_counted(self):
+        self.client.get(reverse('index'))
+        Post.objects.create(text='one more', author=self.user)
+        response, counts = self.count_queries(reverse('index'))
+        self.assertFalse(counts)
+        self.assertEqual(response.context['paginator'].count, 10)
+
+    def test_delete_recounts(self):
+        self.client.get(reverse('profile', args=['author']))
+        Post.objects.first().delete()
+        response = self.client.get(reverse('profile', args=['author']))
+        self.assertEqual(response.context['paginator'].count, 8)
+
+    def test_has_next_without_count(self):
+        cache.add(FEED_COUNT_LOCK_KEY.format('all'), 1)
+        response, counts = self.count_queries(reverse('index'), page=2)
+        self.assertFalse(counts)
+        page = response.context['page']
+        self.assertEqual(page.number, 2)
+        self.assertEqual(len(page), 2)
+        self.assertTrue(page.has_next())
+        response, counts = self.count_queries(reverse('index'), page=5)
+        self.assertFalse(counts)
+        self.assertFalse(response.context['page'].has_next())
+        self.assertEqual(len(response.context['page']), 1)
+
+    def test_page_window(self):
+        response = self.client.get(reverse('index'), {'page': 3})
+        self.assertEqual(response.context['page_range'],
+                         [1, 2, 3, 4, 5])
+        Post.objects.bulk_create(
+            [Post(text=f'bulk {number}', author=self.user)
+             for number in range(11)])
+        cache.clear()
+        response = self.client.get(reverse('index'), {'page': 5})
+        self.assertEqual(response.context['page_range'],
+                         [1, None, 4, 5, 6, None, 10])
+        self.assertContains(response, '&hellip;', count=2)
+
+
+# в yatube/urls.py админка выключена, тесты подключают её сами
+urlpatterns = [path('admin/', admin_site.urls)]
+
+
+@override_settings(ADMIN_ACTION_CHUNK_SIZE=2, ROOT_URLCONF=__name__)
+class TestAdmin(TestCase):
+    """Admin changelists for large tables"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            username='boss', email='boss@example.com', password='12345')
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(title='group', slug='group')
+        for number in range(5):
+            author = User.objects.create_user(username=f'author{number}')
+            post = Post.objects.create(text=f'post {number}', author=author,
+                                       group=self.group)
+            Comment.objects.create(post=post, author=author, text='comment')
+            Follow.objects.create(user=self.admin, author=author)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:posts_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    @override_settings(ADMIN_COUNT_TIMEOUT=0)
+    def test_no_query_per_row(self):
+        self.changelist_queries('post')
+        for model in ('post', 'comment', 'follow'):
+            before = self.changelist_queries(model)
+            author = User.objects.create_user(username=f'extra-{model}')
+            post = Post.objects.create(text='extra', author=author)
+            Comment.objects.create(post=post, author=author, text='extra')
+            Follow.objects.create(user=self.admin, author=author)
+            self.assertEqual(self.changelist_queries(model), before, model)
+
+    def test_count_is_cached(self):
+        self.changelist_queries('post')
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries
+                          if 'COUNT(*)' in query['sql']])
+
+    def test_edit_form_has_no_user_select(self):
+        post = Post.objects.first()
+        response = self.client.get(
+            reverse('admin:posts_post_change', args=[post.pk]))
+        self.assertNotContains(response, '<option value="%d">' % self.admin.pk)
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+
+    def test_delete_in_chunks(self):
+        response = self.client.post(
+            reverse('admin:posts_comment_changelist'),
+            {'action': 'delete_selected_in_chunks',
+             '_selected_action': list(
+                 Comment.objects.values_list('pk', flat=True)[:3])})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_default_delete_is_replaced(self):
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        actions = admin_site._registry[Post].get_actions(request)
+        self.assertNotIn('delete_selected', actions)
+        self.assertIn('delete_selected_in_chunks', actions)
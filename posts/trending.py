@@ -0,0 +1,30 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+
+from .models import PostScore
+from .sharding import post_databases
+
+COMMENT_WEIGHT = 1.0
+VIEW_WEIGHT = 0.05
+
+
+def bump_score(post_id, weight, using=DEFAULT_DB_ALIAS):
+    """Увеличивает рейтинг записи одним UPDATE, создавая строку при
+    первом обращении. ``using`` — база, в которой лежит запись."""
+    scores = PostScore.objects.using(using)
+    if scores.filter(post_id=post_id).update(score=F('score') + weight):
+        return
+    _, created = scores.get_or_create(
+        post_id=post_id, defaults={'score': weight})
+    if not created:
+        scores.filter(post_id=post_id).update(score=F('score') + weight)
+
+
+def decay_scores(factor, min_score=0.01):
+    """Умножает все рейтинги на ``factor`` и удаляет затухшие."""
+    updated = removed = 0
+    for using in post_databases():
+        scores = PostScore.objects.using(using)
+        updated += scores.update(score=F('score') * factor)
+        removed += scores.filter(score__lt=min_score).delete()[0]
+    return updated, removed
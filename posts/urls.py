@@ -5,7 +5,12 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("group/<path:slug>/", views.group_posts, name="group_post"),
+    path("groups/", views.group_index, name="group_index"),
+    path("api/groups/", views.group_stats_api, name="group_stats_api"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("trending/", views.trending, name="trending"),
+    path("tag/<str:name>/", views.tag_posts, name="tag_posts"),
+    path("mentions/", views.mentions, name="mentions"),
     path("new/", views.new_post, name="new_post"),
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
@@ -17,6 +22,16 @@ urlpatterns = [
     path('404/', views.page_not_found, name='error404'),
     path('500/', views.server_error, name='error500'),
     path("<username>/<int:post_id>/comment", views.add_comment, name="add_comment"),
+    path(
+        "<str:username>/<int:post_id>/comments/",
+        views.post_comments,
+        name="post_comments"
+    ),
+    path(
+        "<str:username>/<int:post_id>/react/",
+        views.toggle_reaction,
+        name="toggle_reaction"
+    ),
     # path("follow/", views.follow_index, name="follow_index"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
@@ -1,42 +1,241 @@
+from datetime import datetime
+from functools import reduce
+from operator import attrgetter, or_
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.http import is_safe_url
+from django.views.decorators.http import require_POST
 from posts.forms import PostForm, CommentForm
-from .models import Post, Group, User, Follow
-# import datetime
-from django.core.paginator import Paginator
+from .archive import HotColdFeed, with_archive
+from .objcache import group_cache, post_cache, user_cache
+from .sharding import (merge_slices, post_databases, scatter, shard_for,
+                       sharded)
+from .caching import (feed_count, followed_authors, group_stats, is_following,
+                      pending_user_deletions)
+from .counters import (post_views, profile_views, reaction_counts,
+                       view_scores)
+from .models import (ArchivedPost, Comment, Post, User, Follow,
+                     hide_deleted_authors)
+from .trending import COMMENT_WEIGHT, VIEW_WEIGHT, bump_score
+from django.core.paginator import Page, Paginator
+
+FOLLOW_IN_LIST_LIMIT = 500
+SUGGESTIONS_LIMIT = 5
+
+
+def get_author_or_404(username):
+    """
+    Активный и не ожидающий удаления пользователь из кеша объектов,
+    см. posts.objcache.
+    """
+    author = user_cache.get_by(username)
+    if author is None or not author.is_active or \
+            author.pk in pending_user_deletions():
+        raise Http404('Пользователь не найден')
+    return author
+
+
+def get_post_or_404(username, post_id, fresh=False):
+    """
+    Запись автора ``username``, если автор не ожидает удаления.
+    Копия из кеша объектов может быть старше строки в базе, поэтому
+    изменяющие запись представления читают её из базы с ``fresh``.
+    """
+    author = get_author_or_404(username)
+    using = shard_for(author.pk)
+    if fresh:
+        post = Post.objects.using(using).filter(pk=post_id).first()
+    else:
+        post = post_cache.get(post_id, using=using)
+    if post is None or post.author_id != author.pk:
+        raise Http404('Запись не найдена')
+    post.author = author
+    return post
+
+
+def get_any_post_or_404(username, post_id):
+    """Как get_post_or_404, но ищет и среди перенесённых в архив записей."""
+    try:
+        return get_post_or_404(username, post_id)
+    except Http404:
+        author = get_author_or_404(username)
+        post = get_object_or_404(
+            ArchivedPost.objects.using(shard_for(author.pk)),
+            id=post_id, author_id=author.pk,
+        )
+        post.author = author
+        return post
+
+
+def paginate(request, post_list, scope=None):
+    """
+    Контекст ленты: только ленивая страница ``page`` размером
+    POSTS_PER_PAGE, её ``paginator`` и окно номеров ``page_range``.
+    Полный queryset в шаблон не передаётся, чтобы при отрисовке не
+    загружались все записи.
+
+    Для ленты ``scope`` число записей берётся из кеша (posts.caching),
+    а пока его считает другой запрос, страница отдаётся без подсчёта.
+    """
+    paginator = Paginator(post_list, settings.POSTS_PER_PAGE)
+    number = request.GET.get('page')
+    total = feed_count(scope, lambda: paginator.count) if scope else None
+    if scope and total is None:
+        page = page_without_count(paginator, number)
+    else:
+        if total is not None:
+            # count у Paginator — cached_property
+            paginator.__dict__['count'] = total
+        page = paginator.get_page(number)
+    return {'page': page, 'paginator': paginator,
+            'page_range': page_window(page)}
+
+
+def page_without_count(paginator, number):
+    """
+    Страница ``number`` без COUNT(*): запрашивается на одну запись
+    больше, и по ней видно, есть ли следующая страница.
+    """
+    try:
+        number = max(int(number), 1)
+    except (TypeError, ValueError):
+        number = 1
+    bottom = (number - 1) * paginator.per_page
+    rows = list(paginator.object_list[bottom:bottom + paginator.per_page + 1])
+    if not rows and number > 1:
+        # страница за концом ленты: нужен номер последней
+        return paginator.get_page(number)
+    # для paginator страниц столько, сколько уже видно
+    paginator.__dict__['count'] = bottom + len(rows)
+    return Page(rows[:paginator.per_page], number, paginator)
+
+
+def page_window(page):
+    """Номера первой, последней и PAGINATOR_WINDOW соседних с текущей
+    страниц; пропуски между ними отмечены None."""
+    last = page.paginator.num_pages
+    window = settings.PAGINATOR_WINDOW
+    numbers = {1, last, *range(max(page.number - window, 1),
+                               min(page.number + window, last) + 1)}
+    pages = []
+    previous = 0
+    for number in sorted(numbers):
+        if number - previous > 1:
+            pages.append(None)
+        pages.append(number)
+        previous = number
+    return pages
+
+
+def parse_cursor(cursor):
+    """Курсор вида ``<дата в ISO>_<id>`` или None, если он испорчен."""
+    try:
+        created, object_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created), int(object_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(post_list, link, cursor, **match):
+    """
+    Порция ленты по индексной таблице ``link`` (tag_links или mentions),
+    строки которой отбираются условиями ``match``. Сортировка и курсор
+    идут по её колонкам (pub_date, post_id), поэтому запрос читает индекс
+    таблицы без OFFSET и сортировки.
+    """
+    date, post = f'{link}__pub_date', f'{link}__post_id'
+    # все условия на связь в одном filter(), иначе Django добавит второй JOIN
+    condition = Q(**{f'{link}__{field}': value for field, value in match.items()})
+    position = parse_cursor(cursor)
+    if position:
+        created, post_id = position
+        # условие <= даёт sqlite диапазон по индексу, OR уточняет границу
+        condition &= Q(**{f'{date}__lte': created}) & (
+            Q(**{f'{date}__lt': created}) |
+            Q(**{date: created, f'{post}__lt': post_id}))
+    post_list = post_list.filter(condition).order_by(
+        f'-{date}', F(post).desc())
+    size = settings.POSTS_PER_PAGE
+    parts = scatter(lambda alias: list(post_list.using(alias)[:size]),
+                    post_databases())
+    posts = merge_slices(parts, 0, size, key=attrgetter('pub_date', 'id'))
+    next_cursor = None
+    if len(posts) == size:
+        next_cursor = f'{posts[-1].pub_date.isoformat()}_{posts[-1].id}'
+    return {'posts': posts, 'next_cursor': next_cursor}
+
+
+def follow_suggestions(user):
+    """Рекомендации из FollowSuggestion без уже отслеживаемых авторов."""
+    if user.is_anonymous:
+        return []
+    followed = set(followed_authors(user.id))
+    suggestions = user.suggestions.select_related('author')[:SUGGESTIONS_LIMIT]
+    return [item.author for item in suggestions
+            if item.author_id not in followed]
 
 
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
+    post_list = Post.objects.visible().select_related(
+        'author', 'group').prefetch_related('derivatives')
+    return render(request, 'index.html',
+                  paginate(request, with_archive(sharded(post_list)), 'all'))
 
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request,
-        'index.html',
-        {'page': page, 'paginator': paginator}
-    )
+
+def trending(request):
+    post_list = Post.objects.visible().filter(score__score__gt=0).select_related(
+        'author', 'group', 'score').prefetch_related('derivatives').order_by(
+        '-score__score')
+    post_list = sharded(post_list, key=lambda post: post.score.score)
+    return render(request, 'trending.html',
+                  paginate(request, post_list, 'trending'))
 
 
 def group_posts(request, slug):
     '''
-    Функция get_object_or_404 получает по заданным критериям объект
-    из базы данных или возвращает сообщение об ошибке, если объект не найден.
+    Сообщество берётся из кеша объектов, а если его нет или оно
+    ожидает удаления, возвращается сообщение об ошибке.
     '''
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts_group.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request,
-        'group.html',
-        {'page': page, 'paginator': paginator,
-         'group': group, 'posts': post_list, }
-    )
+    group = group_cache.get_by(slug)
+    if group is None or group.is_deleted:
+        raise Http404('Сообщество не найдено')
+    post_list = group.posts_group.visible().select_related(
+        'author', 'group').prefetch_related('derivatives')
+    context = paginate(request, with_archive(sharded(post_list), group=group),
+                       f'group:{group.pk}')
+    context['group'] = group
+    return render(request, 'group.html', context)
+
+
+def tag_posts(request, name):
+    post_list = Post.objects.visible().select_related(
+        'author', 'group').prefetch_related('derivatives')
+    context = keyset_page(post_list, 'tag_links', request.GET.get('cursor'),
+                          name=name.lower())
+    context['tag'] = name.lower()
+    return render(request, 'tag.html', context)
+
+
+@login_required
+def mentions(request):
+    post_list = Post.objects.visible().select_related(
+        'author', 'group').prefetch_related('derivatives')
+    context = keyset_page(post_list, 'mentions', request.GET.get('cursor'),
+                          user=request.user)
+    return render(request, 'mentions.html', context)
+
+
+def group_index(request):
+    return render(request, 'groups.html', {'groups': group_stats()})
+
+
+def group_stats_api(request):
+    return JsonResponse({'groups': group_stats()})
 
 
 @login_required
@@ -51,38 +250,132 @@ def new_post(request):
 
 
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    paginator = Paginator(user.posts.all(), 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    user = get_author_or_404(username)
+    profile_views.add(user.id)
+    post_list = user.posts.visible().select_related(
+        'author', 'group').prefetch_related('derivatives')
     following = request.user.is_anonymous or \
-                Follow.objects.filter(user=request.user, author=user).exists()  # 79 длина строки
-    return render(request, 'profile.html', {
+                is_following(request.user.id, user.id)
+    follows_you = request.user.is_authenticated and \
+                  request.user != user and \
+                  is_following(user.id, request.user.id)
+    context = paginate(request, with_archive(post_list, author=user),
+                       f'author:{user.pk}')
+    context.update({
         'profile': user,
-        'page': page,
-        'paginator': paginator,
-        'post_list': user.posts.all(),
         'following': following,
+        'follows_you': follows_you,
+        'suggestions': follow_suggestions(request.user),
     })
+    return render(request, 'profile.html', context)
+
+
+def load_threads(roots, max_depth):
+    """
+    Подгружает ответы к ``roots`` одним запросом по диапазонам
+    материализованного пути, не глубже ``max_depth`` уровней. Ответы
+    складываются в ``root.thread`` в порядке обхода дерева, у ответа
+    на границе глубины с продолжением ветки выставляется ``has_more``.
+    """
+    if not roots:
+        return
+    base = roots[0].depth
+    # у записей из архива ветки лежат в ArchivedComment
+    replies = hide_deleted_authors(
+        type(roots[0])._default_manager.using(roots[0]._state.db)
+    ).filter(
+        reduce(or_, (root.subtree_filter() for root in roots)),
+        depth__gt=base,
+        depth__lte=base + max_depth + 1,
+    ).select_related('author').order_by('path')
+    prefix_length = (base + 1) * Comment.PATH_STEP
+    by_path = {}
+    for root in roots:
+        root.indent = 0
+        root.thread = []
+        by_path[root.path] = root
+    for reply in replies:
+        if reply.depth > base + max_depth:
+            # родителя может не быть, если его автор скрыт
+            parent = by_path.get(reply.path[:-Comment.PATH_STEP])
+            if parent is not None:
+                parent.has_more = True
+            continue
+        reply.indent = reply.depth - base
+        by_path[reply.path[:prefix_length]].thread.append(reply)
+        by_path[reply.path] = reply
+
+
+def comment_page(post, cursor=None):
+    """
+    Порция веток комментариев записи: не больше COMMENTS_PER_PAGE
+    корневых комментариев с ответами до COMMENTS_THREAD_DEPTH уровней
+    и курсор ``created_id`` для следующей порции. Курсор позволяет не
+    считать OFFSET, сколько бы комментариев ни было у записи.
+    """
+    comments = hide_deleted_authors(post.comments.filter(
+        depth=0)).select_related('author')
+    position = parse_cursor(cursor)
+    if position:
+        created, comment_id = position
+        comments = comments.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=comment_id)
+        )
+    comments = comments[:settings.COMMENTS_PER_PAGE]
+    load_threads(list(comments), settings.COMMENTS_THREAD_DEPTH)
+    next_cursor = None
+    if len(comments) == settings.COMMENTS_PER_PAGE:
+        last = comments[len(comments) - 1]
+        next_cursor = f'{last.created.isoformat()}_{last.id}'
+    return comments, next_cursor
 
 
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    post = get_any_post_or_404(username, post_id)
+    if not post.is_archived:
+        post_views.add(post.id)
+        view_scores.add(post.id, VIEW_WEIGHT)
     count = post.author.posts.count()
-    comments = post.comments.all()
+    comments, next_cursor = comment_page(post)
     form = CommentForm()
     return render(request, 'post.html', {
         'post': post,
         "profile": post.author,
         'my_post': count,
         "comments": comments,
+        'next_cursor': next_cursor,
         'form': form,
     })
 
 
+def comment_id_or_404(value):
+    """id комментария из параметра запроса: не число — 404, а не 500."""
+    if not (value.isascii() and value.isdigit()):
+        raise Http404('Комментарий не найден')
+    return int(value)
+
+
+def post_comments(request, username, post_id):
+    post = get_any_post_or_404(username, post_id)
+    thread = request.GET.get('thread')
+    if thread:
+        # продолжение глубокой ветки, начиная с указанного комментария
+        root = get_object_or_404(post.comments.select_related('author'),
+                                 id=comment_id_or_404(thread))
+        load_threads([root], settings.COMMENTS_THREAD_DEPTH)
+        comments, next_cursor = root.thread, None
+    else:
+        comments, next_cursor = comment_page(post, request.GET.get('cursor'))
+    return render(request, 'includes/comment_list.html', {
+        'post': post,
+        'items': comments,
+        'next_cursor': next_cursor,
+    })
+
+
 @login_required
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_post_or_404(username, post_id, fresh=True)
     if request.user != post.author:
         return redirect('post', username=username, post_id=post_id)
     form = PostForm(
@@ -112,32 +405,77 @@ def server_error(request):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    comments = post.comments.all()
+    post = get_post_or_404(username, post_id, fresh=True)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         new_comment = form.save(commit=False)
         new_comment.author = request.user
         new_comment.post = post
+        parent_id = request.POST.get('parent')
+        if parent_id:
+            new_comment.parent = get_object_or_404(
+                post.comments, id=comment_id_or_404(parent_id))
         new_comment.save()
+        bump_score(post.id, COMMENT_WEIGHT, using=post._state.db)
         return redirect('post', username=username,
                         post_id=post_id)
 
+    comments, next_cursor = comment_page(post)
     return render(request, 'includes/comments.html',
                   {'post': post,
                    'author': post.author,
                    'form': form,
-                   'comments': comments}, )
+                   'items': comments,
+                   'next_cursor': next_cursor}, )
+
+
+@login_required
+@require_POST
+def toggle_reaction(request, username, post_id):
+    post = get_post_or_404(username, post_id, fresh=True)
+    removed, _ = post.reactions.filter(user=request.user).delete()
+    if removed:
+        reaction_counts.add(post.id, -1)
+    else:
+        try:
+            with transaction.atomic():
+                post.reactions.create(user=request.user)
+        except IntegrityError:
+            # повторный клик, пришедший одновременно с первым
+            pass
+        else:
+            reaction_counts.add(post.id, 1)
+    next_url = request.POST.get('next')
+    if next_url and is_safe_url(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('post', username=username, post_id=post_id)
+
+
+def followed_posts(model, authors):
+    """
+    Записи ``model`` авторов ``authors`` из всех шардов. Подписки живут
+    только в основной базе, поэтому id авторов передаются в запрос
+    списком, порциями не больше FOLLOW_IN_LIST_LIMIT, чтобы не упереться
+    в лимит параметров sqlite.
+    """
+    queryset = model.objects.visible().select_related('author', 'group')
+    if model is Post:
+        queryset = queryset.prefetch_related('derivatives')
+    chunks = []
+    for start in range(0, len(authors), FOLLOW_IN_LIST_LIMIT):
+        chunk = authors[start:start + FOLLOW_IN_LIST_LIMIT].tolist()
+        chunks.append(queryset.filter(author_id__in=chunk))
+    return sharded(*chunks or [queryset.none()])
 
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user).all()  #
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'follow.html',
-                  {'page': page, 'paginator': paginator})
+    authors = followed_authors(request.user.id)
+    feed = HotColdFeed(followed_posts(Post, authors),
+                       followed_posts(ArchivedPost, authors))
+    context = paginate(request, feed, f'follow:{request.user.pk}')
+    context['suggestions'] = follow_suggestions(request.user)
+    return render(request, 'follow.html', context)
 
 
 @login_required
@@ -151,8 +489,6 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    follow_to_delete = Follow.objects.filter(user=request.user,
-                                             author=author)
-    if follow_to_delete.exists():
-        follow_to_delete.delete()
+    # удаление — один запрос, а набор подписок в кеше мог отстать от базы
+    Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('profile', username=username)
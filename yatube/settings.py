@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # сжимает ответ последним, поэтому стоит первым, см. posts.middleware
+    'posts.middleware.CompressionMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
 
     'django.middleware.security.SecurityMiddleware',
@@ -67,12 +69,25 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 
+# Отступы и HTML-комментарии убираются из шаблонов при компиляции, см.
+# posts.template_loaders; без DEBUG скомпилированные шаблоны кешируются
+TEMPLATE_LOADERS = [
+    ('posts.template_loaders.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+if not DEBUG:
+    TEMPLATE_LOADERS = [
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    ]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'yatube.context_processors.year',
                 'django.template.context_processors.debug',
@@ -133,11 +148,52 @@ USE_TZ = False
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
+# collectstatic добавляет в имена хеш содержимого, склеивает наборы
+# STATIC_BUNDLES и кладёт рядом сжатые копии .gz, см. posts.staticfiles
+STATICFILES_STORAGE = 'posts.staticfiles.CompressedManifestStaticFilesStorage'
+
+STATIC_BUNDLES = {
+    'bundle/site.css': [
+        'bootstrap/dist/css/bootstrap.min.css',
+    ],
+    'bundle/site.js': [
+        'jquery/dist/jquery.min.js',
+        'bootstrap/dist/js/bootstrap.min.js',
+    ],
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Login
 
+# Сессии читаются из кеша, а база остаётся источником правды; пользователь
+# запроса тоже берётся из кеша, см. posts.auth
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# ModelBackend остаётся в списке: в сессиях, открытых до включения
+# кеша, записан его путь, и без него эти пользователи разлогинятся
+AUTHENTICATION_BACKENDS = [
+    'posts.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Сколько секунд пользователь запроса живёт в кеше без изменений
+USER_CACHE_TIMEOUT = 60 * 60
+
+# Кеш записей, авторов и сообществ для страниц по адресу, см. posts.objcache.
+# Версию нужно поднять, если поменялись поля этих моделей
+OBJECT_CACHE_VERSION = 1
+OBJECT_CACHE_TIMEOUT = 60 * 10
+# память процесса: сколько объектов и сколько секунд другие процессы
+# могут видеть старую копию
+OBJECT_CACHE_LOCAL_SIZE = 1000
+OBJECT_CACHE_LOCAL_TIMEOUT = 5
+
+# Сколько секунд процесс держит статические страницы в памяти, если их
+# поменяли мимо сигналов, см. posts.flatpages
+FLATPAGES_LOCAL_TIMEOUT = 60
+
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "index"
 # LOGOUT_REDIRECT_URL = "index"
@@ -156,8 +212,102 @@ INTERNAL_IPS = [
     # ...
 ]
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Кеш должен быть общим для всех процессов сервера: в нём версии
+# пользователей, подписки и версия статических страниц, и изменение в
+# одном воркере сразу видят остальные. При нескольких воркерах задайте
+# адреса memcached в YATUBE_MEMCACHED через запятую: add() и incr() в нём
+# атомарны, на них держатся блокировка подсчёта лент и счётчики. Без
+# переменной используется LocMemCache — он свой у каждого процесса и
+# годится для разработки, тестов и сервера из одного процесса.
+MEMCACHED_LOCATIONS = [location for location in
+                       os.environ.get('YATUBE_MEMCACHED', '').split(',')
+                       if location]
+if MEMCACHED_LOCATIONS:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATIONS,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Количество записей на странице ленты
+POSTS_PER_PAGE = 10
+
+# Сколько секунд хранится число записей ленты. Новые записи прибавляются
+# к нему сразу, а удаления, смена сообщества и записи отслеживаемых
+# авторов в ленте подписок учитываются не позже чем через это время
+FEED_COUNT_TIMEOUT = 60 * 5
+# Сколько страниц показывать по обе стороны от текущей
+PAGINATOR_WINDOW = 2
+
+# Админка: сколько секунд хранится число строк списка и сколько строк
+# удаляет одна транзакция действия «Удалить порциями»
+ADMIN_COUNT_TIMEOUT = 60
+ADMIN_ACTION_CHUNK_SIZE = 500
+
+# Количество комментариев, подгружаемых за раз
+COMMENTS_PER_PAGE = 20
+
+# Сколько уровней ответов показывать в ветке комментариев за раз
+COMMENTS_THREAD_DEPTH = 4
+
+# Буферизованные счётчики: сброс в базу раз в N секунд или по размеру
+COUNTER_FLUSH_INTERVAL = 10
+COUNTER_FLUSH_SIZE = 100
+
+# Записи старше стольких дней команда archive_posts переносит в архив
+ARCHIVE_AFTER_DAYS = 365
+
+# Шардирование записей по автору: записи, комментарии и всё, что к ним
+# привязано, раскладываются по POST_SHARD_COUNT отдельным файлам sqlite,
+# см. posts.sharding. При 0 всё хранится в основной базе.
+POST_SHARD_COUNT = int(os.environ.get('YATUBE_POST_SHARDS', 0))
+POST_SHARDS = [f'posts_{number}' for number in range(POST_SHARD_COUNT)]
+for alias in POST_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
     }
-}
\ No newline at end of file
+
+DATABASE_ROUTERS = ['posts.sharding.PostShardRouter']
+
+# Загружаемые файлы пишутся во временный файл на диске, а не в память,
+# и попутно хешируются для хранилища posts.storage
+FILE_UPLOAD_HANDLERS = [
+    'posts.storage.HashingUploadHandler',
+]
+# Временные файлы создаются с правами 0600; файлы хранилища читает и
+# веб-сервер, который отдаёт их по X-Accel-Redirect
+FILE_UPLOAD_PERMISSIONS = 0o644
+
+# Кто отдаёт тело файлов media и static, см. posts.serving: None — Django
+# через wsgi.file_wrapper (os.sendfile у gunicorn), 'x-accel' — nginx по
+# X-Accel-Redirect, 'x-sendfile' — apache или lighttpd
+SENDFILE_BACKEND = os.environ.get('YATUBE_SENDFILE_BACKEND') or None
+
+# internal location nginx: /media/a.jpg уходит на /internal/media/a.jpg
+SENDFILE_ACCEL_PREFIX = '/internal'
+
+# Сколько секунд браузер не перепроверяет файл без хеша в имени
+SERVE_MAX_AGE = 0
+
+# Ответы короче этого не сжимаются: выигрыш меньше пакета, см. posts.middleware
+GZIP_MIN_LENGTH = 860
+
+# Файлы без ссылок удаляются collect_media не раньше, чем через столько часов
+MEDIA_GC_GRACE_HOURS = 24
+
+# Наибольшая сторона сохраняемого изображения записи, px
+POST_IMAGE_MAX_SIZE = 2048
+
+# Изображения с большим числом пикселей отклоняются без декодирования
+POST_IMAGE_MAX_PIXELS = 50_000_000
+
+# Ширины копий изображения записи для srcset карточки, px
+POST_IMAGE_WIDTHS = (320, 640, 960)
@@ -16,36 +16,37 @@ Including another URLconf
 import debug_toolbar
 from django.contrib import admin
 from django.urls import include, path
-from django.contrib.flatpages import views
 from django.conf.urls import handler404, handler500
 from django.conf import settings
-from django.conf.urls.static import static
+
+from posts.flatpages import flatpage
+from posts.serving import file_urls
 
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
 urlpatterns = [
     # path('admin/', admin.site.urls),
-    path('about/', include('django.contrib.flatpages.urls')),
+    # страницы отдаются из памяти процесса, см. posts.flatpages
+    path('about/<path:url>', flatpage,
+         name='django.contrib.flatpages.views.flatpage'),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
-    path('about-author/', views.flatpage, {'url': '/about-author/'}, name='about-author'),
-    path('about-spec/', views.flatpage, {'url': '/about-spec/'}, name='about-spec'),
+    path('about-author/', flatpage, {'url': '/about-author/'}, name='about-author'),
+    path('about-spec/', flatpage, {'url': '/about-spec/'}, name='about-spec'),
+    # до posts.urls, иначе адрес забирает профиль <str:username>/
+    path('about-us/', flatpage, {'url': '/about-us/'}, name='about'),
+    path('terms/', flatpage, {'url': '/terms/'}, name='terms'),
     path('', include('posts.urls')),
     # path('__debug__/', include(debug_toolbar.urls)),
 ]
 
-
-urlpatterns += [
-    path('about-us/', views.flatpage, {'url': '/about-us/'}, name='about'),
-    path('terms/', views.flatpage, {'url': '/terms/'}, name='terms'),
-
-]
-
 if settings.DEBUG:
     import debug_toolbar
 
     urlpatterns += (path("__debug__/", include(debug_toolbar.urls)),)
 
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+# файлы отдаются и без DEBUG: с поддержкой Range, кешированием и передачей
+# тела nginx или os.sendfile, см. posts.serving
+urlpatterns += file_urls(settings.MEDIA_URL, settings.MEDIA_ROOT)
+urlpatterns += file_urls(settings.STATIC_URL, settings.STATIC_ROOT)
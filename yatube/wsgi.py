@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
 """
 
+import atexit
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# накопленные счётчики пишутся в базу по таймеру, даже если запросов
+# нет, и при остановке воркера; тогда же в лог пишется, сколько байт
+# сэкономило сжатие ответов и как часто объекты находились в кеше
+from posts.counters import flush_all, start_flush_timer  # noqa: E402
+from posts.middleware import compression_report  # noqa: E402
+from posts.objcache import object_cache_report  # noqa: E402
+
+start_flush_timer()
+atexit.register(flush_all)
+atexit.register(compression_report)
+atexit.register(object_cache_report)